@@ -9,6 +9,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from scipy.optimize import brentq
 
 def computeRepresentativeCell(N, Volume):
     """Representative cell definition.
@@ -28,37 +29,151 @@ def computeRefinementFactor(N1, N2):
 
     return r
 
-def computeApparentOrder(r_21, r_32, phi_1, phi_2, phi_3):
-    """
+def computeApparentOrder(r_21, r_32, phi_1, phi_2, phi_3, tol=1e-12, max_iter=1000, fallback=True):
+    """Apparent order of every point from the fixed-point iteration of Celik et al., iterating all points at once. Points that did not converge (e.g. oscillatory convergence, s < 0) can be solved with a Newton/Brent fallback.
+
+    Parameters
+    ----------
+    r_21: float
+        Refinement factor between grids 1 and 2.
+    r_32: float
+        Refinement factor between grids 2 and 3.
+    phi_1: array
+        Variable of interest on grid 1.
+    phi_2: array
+        Variable of interest on grid 2.
+    phi_3: array
+        Variable of interest on grid 3.
+    tol: float
+        Absolute tolerance on the apparent order.
+    max_iter: int
+        Maximum number of fixed-point iterations.
+    fallback: bool
+        If True, solves the non converged points with Newton iterations and Brent method.
+
+    Returns
+    -------
+    p: array
+        Apparent order for each point (nan where no solution was found).
 
     """
-    tol =1e-12
-    max_iter = 1000
-    itr = 0
-    error=1
 
-    e_21 = phi_2 - phi_1
-    e_32 = phi_3 - phi_2
+    e_21 = np.asarray(phi_2 - phi_1, dtype=float)
+    e_32 = np.asarray(phi_3 - phi_2, dtype=float)
 
-    p = []
-    for  e_32_i, e_21_i in zip(e_32, e_21):
-    
-        p_i = np.abs(np.log(np.abs(e_32_i/e_21_i)))/np.log(r_21)
-    
-        s = np.sign(e_32_i/e_21_i)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = e_32/e_21
+        logRatio = np.abs(np.log(np.abs(ratio)))
+        s = np.sign(ratio)
+
+        p = logRatio/np.log(r_21)
+        active = np.isfinite(p)
+        p[~active] = np.nan # e_21 or e_32 equal to zero
 
-        while(error>tol and itr<max_iter):
-            p0 = p_i
-            q = np.log((r_21**p0-s)/(r_32**p0-s))
+        for itr in range(max_iter):
+            if not active.any():
+                break
+            p0 = p[active]
+            q = np.log((r_21**p0-s[active])/(r_32**p0-s[active]))
 
-            p_i = np.abs(np.abs(np.log(np.abs(e_32_i/e_21_i)))+q)/np.log(r_21)
+            p_i = np.abs(logRatio[active]+q)/np.log(r_21)
+            p[active] = p_i
 
-            error = np.linalg.norm(p_i-p0)
-            itr +=1
-        p.append(p_i)
+            converged = np.abs(p_i-p0)<=tol
+            active[active] = ~converged
+
+    if fallback and active.any():
+        p[active] = solveApparentOrder(r_21, r_32, logRatio[active], s[active], p[active], tol)
+    else:
+        p[active] = np.nan
 
     return p
 
+def solveApparentOrder(r_21, r_32, logRatio, s, p, tol, max_iter=50):
+    """Root finding fallback for the apparent order equation p = |ln|e_32/e_21|+q(p)|/ln(r_21). Vectorized Newton iterations are tried first and Brent method is used on the points where Newton fails.
+
+    Parameters
+    ----------
+    r_21: float
+        Refinement factor between grids 1 and 2.
+    r_32: float
+        Refinement factor between grids 2 and 3.
+    logRatio: array
+        |ln|e_32/e_21|| for each point.
+    s: array
+        Sign of e_32/e_21 for each point.
+    p: array
+        Initial guess for each point.
+    tol: float
+        Absolute tolerance on the apparent order.
+    max_iter: int
+        Maximum number of Newton iterations.
+
+    Returns
+    -------
+    p: array
+        Apparent order for each point (nan where no solution was found).
+
+    """
+
+    def residual(p, logRatio, s):
+        return p-np.abs(logRatio+np.log((r_21**p-s)/(r_32**p-s)))/np.log(r_21)
+
+    p = np.where(np.isfinite(p), p, logRatio/np.log(r_21))
+    active = np.ones(p.shape, dtype=bool)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for itr in range(max_iter):
+            if not active.any():
+                break
+            p0 = p[active]
+            s_i = s[active]
+            u = logRatio[active]+np.log((r_21**p0-s_i)/(r_32**p0-s_i))
+            dq = (np.log(r_21)*r_21**p0/(r_21**p0-s_i)-
+                    np.log(r_32)*r_32**p0/(r_32**p0-s_i))
+            g = p0-np.abs(u)/np.log(r_21)
+            dg = 1-np.sign(u)*dq/np.log(r_21)
+
+            p_i = p0-g/dg
+            p[active] = p_i
+
+            converged = np.abs(p_i-p0)<=tol
+            active[active] = ~converged
+
+        failed = active | ~np.isfinite(p) | (p<0)
+
+    for i in np.nonzero(failed)[0]:
+        p[i] = np.nan
+        f = lambda x: residual(x, logRatio[i], s[i])
+        p_hi = 1.0
+        while p_hi<1e3:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if f(tol)*f(p_hi)<0:
+                    p[i] = brentq(f, tol, p_hi, xtol=tol)
+                    break
+            p_hi *= 2
+
+    return p
+
+def computeExtrapolatedValue(r_21, phi_1, phi_2, p):
+    """Richardson extrapolated value.
+
+    """
+
+    phi_21_extrapolated = (r_21**p*phi_1-phi_2)/(r_21**p-1)
+
+    return phi_21_extrapolated
+
+def computeFineGCI(r_21, phi_1, phi_2, p):
+    """Fine grid convergence index.
+
+    """
+
+    error_21 = np.abs((phi_1-phi_2)/phi_1)
+
+    GCI_fine = 1.25*error_21/(r_21**p-1)
+
+    return GCI_fine
 
 if __name__=='__main__':
 
@@ -104,12 +219,10 @@ if __name__=='__main__':
             color='gray',marker='o', capsize=5, label='experimental')
     plt.legend()
 
-    phi_21_extrapolated = (r_21**p*phi_1-phi_2)/(r_21**p-1)
-    phi_32_extrapolated = (r_32**p*phi_2-phi_3)/(r_32**p-1)
+    phi_21_extrapolated = computeExtrapolatedValue(r_21, phi_1, phi_2, p)
+    phi_32_extrapolated = computeExtrapolatedValue(r_32, phi_2, phi_3, p)
 
-    error_21 = np.abs((phi_1-phi_2)/phi_1)
-    
-    GCI_fine = 1.25*error_21/(r_21**np.mean(p)-1)
+    GCI_fine = computeFineGCI(r_21, phi_1, phi_2, np.nanmean(p))
     
     plt.figure()
     plt.errorbar(fine_data['pressure']*997*1e-5, experimental_data['flow_rate'],
@@ -0,0 +1,110 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Batch Grid Convergence Index (GCI) over many cases, quantities and probe points. A manifest lists the cases and monitored quantities, each case is processed on a worker process (cell counts and refinement factors are read once per case) and all points of all quantities of a case go through a single vectorized apparent order evaluation. Results are written to one consolidated table without plotting.
+
+Files for each case follow the naming used in GCI.py: <path>/<case>_cells_data.csv and <path>/<case>_<quantity>_<coarseSim|fineSim|extraFineSim>.csv with a <quantity> column.
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from GCI import computeRefinementFactor, computeApparentOrder, computeExtrapolatedValue, computeFineGCI
+
+GRIDS = ['coarseSim', 'fineSim', 'extraFineSim']
+
+def processCase(case, path, quantities):
+    """GCI for every quantity and point of a single case.
+
+    Parameters
+    ----------
+    case: str
+        Case (sample) name, e.g. 3C.
+    path: str
+        Directory with the case csv files.
+    quantities: list
+        Monitored quantities, e.g. ['pressure'].
+
+    Returns
+    -------
+    results: DataFrame
+        One row per (quantity, point).
+
+    """
+
+    N_data = pd.read_csv(os.path.join(path, case+'_cells_data.csv'), header=None)
+    N1, N2, N3 = [N_data[i].to_numpy()[0] for i in range(3)]
+
+    r_21 = computeRefinementFactor(N1, N2)
+    r_32 = computeRefinementFactor(N2, N3)
+
+    phi = [[], [], []]
+    quantityColumn = []
+    pointColumn = []
+    for quantity in quantities:
+        for level, grid in enumerate(GRIDS):
+            data = pd.read_csv(os.path.join(path, case+'_'+quantity+'_'+grid+'.csv'))
+            phi[level].append(data[quantity].to_numpy(dtype=float))
+        quantityColumn += [quantity]*len(phi[0][-1])
+        pointColumn.append(np.arange(len(phi[0][-1])))
+
+    phi_1, phi_2, phi_3 = [np.concatenate(values) for values in phi]
+
+    p = computeApparentOrder(r_21, r_32, phi_1, phi_2, phi_3)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results = pd.DataFrame({'case': case, 'quantity': quantityColumn,
+            'point': np.concatenate(pointColumn),
+            'phi_1': phi_1, 'phi_2': phi_2, 'phi_3': phi_3,
+            'r_21': r_21, 'r_32': r_32, 'p': p,
+            'extrapolated': computeExtrapolatedValue(r_21, phi_1, phi_2, p),
+            'GCI_fine': computeFineGCI(r_21, phi_1, phi_2, p)})
+
+    return results
+
+def runBatchGCI(manifest, outputFile, processes=None):
+    """Runs the GCI for every case of a manifest on a process pool and writes a single table.
+
+    Parameters
+    ----------
+    manifest: DataFrame or str
+        Manifest (or csv file name) with case, path and quantity columns (one row per case and quantity).
+    outputFile: str
+        Output csv file name.
+    processes: int
+        Number of worker processes (default: number of CPUs).
+
+    Returns
+    -------
+    results: DataFrame
+        Consolidated results table.
+
+    """
+
+    if isinstance(manifest, str):
+        manifest = pd.read_csv(manifest)
+
+    tasks = [(case, path, list(group['quantity']))
+            for (case, path), group in manifest.groupby(['case', 'path'], sort=False)]
+
+    with Pool(processes) as pool:
+        results = pd.concat(pool.starmap(processCase, tasks), ignore_index=True)
+
+    results.to_csv(outputFile, index=False)
+
+    return results
+
+if __name__=='__main__':
+
+    basePath = '/home/solcia/Documents/phd/CFDcases/'
+    cases = ['3A', '3B', '3C']
+
+    manifest = pd.DataFrame({'case': cases,
+                             'path': [basePath+case+'/data' for case in cases],
+                             'quantity': ['pressure']*len(cases)})
+
+    results = runBatchGCI(manifest, basePath+'GCI_results.csv')
+
+    print(results.groupby(['case', 'quantity'])[['p', 'GCI_fine']].median())
@@ -0,0 +1,292 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Field-wide Grid Convergence Index (GCI) from coarse, fine and extra fine OpenFOAM cases (e.g. AM1 or simple_pipe with three mesh levels). Fields are parsed once into .npy caches and read back memory-mapped, mapped onto a common point set with KD-tree indices built once and reused for every time step, and processed in chunks of points.
+
+Cell centres are read from the C field written by: postProcess -func writeCellCentres
+
+"""
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+from scipy.spatial import cKDTree
+from GCI import computeRefinementFactor, computeApparentOrder, computeExtrapolatedValue, computeFineGCI
+
+def timeDirectories(casePath):
+    """Sorted time directories from an OpenFOAM case.
+
+    Parameters
+    ----------
+    casePath: str
+        OpenFOAM case directory.
+
+    Returns
+    -------
+    times: list
+        Time directory names sorted by time value.
+
+    """
+
+    times = []
+    for name in os.listdir(casePath):
+        try:
+            float(name)
+        except ValueError:
+            continue
+        if os.path.isdir(os.path.join(casePath, name)):
+            times.append(name)
+
+    return sorted(times, key=float)
+
+def readFoamField(fileName, nCells=None):
+    """Reads the internalField from an ascii OpenFOAM volScalarField or volVectorField.
+
+    Parameters
+    ----------
+    fileName: str
+        Field file (e.g. case/100/p).
+    nCells: int
+        Number of cells, only needed for uniform fields.
+
+    Returns
+    -------
+    field: array
+        Field values with shape (nCells,) or (nCells, 3).
+
+    """
+
+    with open(fileName, 'r') as f:
+        text = f.read()
+
+    if 'format      binary' in text or 'format binary' in text:
+        raise ValueError('Only ascii OpenFOAM fields are supported: '+fileName)
+
+    start = text.index('internalField')
+    header = text[start:text.index('\n', start)]
+
+    if 'nonuniform' not in header:
+        value = header.split('uniform', 1)[1].strip().rstrip(';')
+        value = np.array(value.strip('()').split(), dtype=float)
+        if nCells is None:
+            raise ValueError('nCells is needed for uniform field: '+fileName)
+        return np.tile(value, (nCells, 1)).squeeze()
+
+    countStart = text.index('>', start)+1
+    listStart = text.index('(', countStart)
+    nValues = int(text[countStart:listStart])
+    listEnd = text.index('\n)', listStart)
+
+    values = np.array(text[listStart+1:listEnd].replace('(', ' ').replace(')', ' ').split(), dtype=float)
+
+    return values.reshape(nValues, -1).squeeze()
+
+def cachedField(casePath, time, fieldName, cachePath, nCells=None):
+    """Memory-mapped field array. The ascii field is parsed only once and saved as .npy on cachePath.
+    The cache name is keyed on the full case path and on the source file mtime and size, so cases
+    with the same directory name do not share caches and changed fields are parsed again.
+
+    Parameters
+    ----------
+    casePath: str
+        OpenFOAM case directory.
+    time: str
+        Time directory name.
+    fieldName: str
+        Field name (e.g. p, U or C).
+    cachePath: str
+        Directory for the .npy caches.
+    nCells: int
+        Number of cells, only needed for uniform fields.
+
+    Returns
+    -------
+    field: memmap
+        Read only memory-mapped field.
+
+    """
+
+    os.makedirs(cachePath, exist_ok=True)
+
+    fileName = os.path.join(casePath, time, fieldName)
+    status = os.stat(fileName)
+    key = hashlib.sha256('|'.join([os.path.abspath(os.path.normpath(casePath)), time, fieldName,
+            str(status.st_mtime_ns), str(status.st_size)]).encode()).hexdigest()[:16]
+    cacheName = os.path.join(cachePath, os.path.basename(os.path.normpath(casePath))+'_'+time+'_'+fieldName+'_'+key+'.npy')
+
+    if not os.path.exists(cacheName):
+        # written to a temporary file first, an interrupted write never leaves a valid looking cache
+        descriptor, temporaryName = tempfile.mkstemp(suffix='.npy', dir=cachePath)
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                np.save(f, readFoamField(fileName, nCells))
+            os.replace(temporaryName, cacheName)
+        except BaseException:
+            os.remove(temporaryName)
+            raise
+
+    return np.load(cacheName, mmap_mode='r')
+
+def readCellCentres(casePath, cachePath):
+    """Cell centres from the first time directory containing the C field.
+
+    """
+
+    for time in timeDirectories(casePath):
+        if os.path.exists(os.path.join(casePath, time, 'C')):
+            return cachedField(casePath, time, 'C', cachePath)
+
+    raise FileNotFoundError('No C field found in '+casePath+'. Run postProcess -func writeCellCentres.')
+
+def buildMapping(sourcePoints, targetPoints, k=4, chunkSize=1000000):
+    """KD-tree inverse distance mapping from source points to target points. Built once and reused
+    for every field and time step.
+
+    Parameters
+    ----------
+    sourcePoints: array
+        Points where the field is known (n_source, 3).
+    targetPoints: array
+        Points where the field is needed (n_target, 3).
+    k: int
+        Number of neighbours.
+    chunkSize: int
+        Number of target points per KD-tree query.
+
+    Returns
+    -------
+    indices: array
+        Neighbour indices (n_target, k).
+    weights: array
+        Inverse distance weights (n_target, k).
+
+    """
+
+    tree = cKDTree(sourcePoints)
+
+    n_target = len(targetPoints)
+    indices = np.zeros((n_target, k), dtype=np.int64)
+    weights = np.zeros((n_target, k))
+
+    for start in range(0, n_target, chunkSize):
+        stop = min(start+chunkSize, n_target)
+        distance, index = tree.query(np.asarray(targetPoints[start:stop]), k=k)
+        distance = distance.reshape(stop-start, k)
+        index = index.reshape(stop-start, k)
+
+        with np.errstate(divide='ignore'):
+            w = 1/distance
+        exact = ~np.isfinite(w)
+        w[exact.any(axis=1)] = exact[exact.any(axis=1)]
+
+        indices[start:stop] = index
+        weights[start:stop] = w/w.sum(axis=1, keepdims=True)
+
+    return indices, weights
+
+def mapField(field, indices, weights):
+    """Field values on the target points of a mapping.
+
+    Parameters
+    ----------
+    field: array
+        Source field (n_source,) or (n_source, 3).
+    indices: array
+        Neighbour indices from buildMapping.
+    weights: array
+        Inverse distance weights from buildMapping.
+
+    Returns
+    -------
+    mapped: array
+        Field on target points.
+
+    """
+
+    values = np.asarray(field[indices.reshape(-1)]).reshape(indices.shape+np.shape(field)[1:])
+    weights = weights.reshape(weights.shape+(1,)*(values.ndim-2))
+
+    return np.sum(weights*values, axis=1)
+
+def computeFieldGCI(casePaths, fieldName, times, outputPath, cachePath, k=4, chunkSize=1000000):
+    """GCI maps for a field over several time steps. Fine and extra fine fields are mapped onto the
+    coarse cell centres (the smallest point set).
+
+    Parameters
+    ----------
+    casePaths: list
+        Coarse, fine and extra fine OpenFOAM case directories.
+    fieldName: str
+        Field name (e.g. p or U).
+    times: list
+        Time directory names (the same on the three cases).
+    outputPath: str
+        Directory for the result .npy files (p, extrapolated and GCI_fine for each time).
+    cachePath: str
+        Directory for the memory-mapped field caches.
+    k: int
+        Number of neighbours on the mapping.
+    chunkSize: int
+        Number of points processed at once.
+
+    Returns
+    -------
+    outputFiles: list
+        Names of the written result files.
+
+    """
+
+    os.makedirs(outputPath, exist_ok=True)
+
+    centres = [readCellCentres(casePath, cachePath) for casePath in casePaths]
+    N1, N2, N3 = [len(centre) for centre in centres]
+
+    r_21 = computeRefinementFactor(N1, N2)
+    r_32 = computeRefinementFactor(N2, N3)
+
+    mappings = [buildMapping(centres[level], centres[0], k, chunkSize) for level in (1, 2)]
+
+    outputFiles = []
+    for time in times:
+        phi_1, phi_2, phi_3 = [cachedField(casePath, time, fieldName, cachePath, nCells=N)
+                for casePath, N in zip(casePaths, (N1, N2, N3))]
+
+        baseName = os.path.join(outputPath, fieldName+'_'+time)
+        results = {name: np.lib.format.open_memmap(baseName+'_'+name+'.npy', mode='w+',
+                    dtype=float, shape=phi_1.shape) for name in ('p', 'extrapolated', 'GCI_fine')}
+
+        for start in range(0, N1, chunkSize):
+            stop = min(start+chunkSize, N1)
+            chunk = slice(start, stop)
+
+            phi_1_chunk = np.asarray(phi_1[chunk])
+            phi_2_chunk = mapField(phi_2, mappings[0][0][chunk], mappings[0][1][chunk])
+            phi_3_chunk = mapField(phi_3, mappings[1][0][chunk], mappings[1][1][chunk])
+
+            p = computeApparentOrder(r_21, r_32, phi_1_chunk.reshape(-1),
+                    phi_2_chunk.reshape(-1), phi_3_chunk.reshape(-1)).reshape(phi_1_chunk.shape)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results['p'][chunk] = p
+                results['extrapolated'][chunk] = computeExtrapolatedValue(r_21, phi_1_chunk, phi_2_chunk, p)
+                results['GCI_fine'][chunk] = computeFineGCI(r_21, phi_1_chunk, phi_2_chunk, p)
+
+        for name, result in results.items():
+            result.flush()
+            outputFiles.append(baseName+'_'+name+'.npy')
+
+    return outputFiles
+
+if __name__=='__main__':
+
+    casePaths = ['/home/solcia/Documents/phd/CFDcases/AM1_coarse',
+                 '/home/solcia/Documents/phd/CFDcases/AM1_fine',
+                 '/home/solcia/Documents/phd/CFDcases/AM1_extraFine']
+    outputPath = '/home/solcia/Documents/phd/CFDcases/AM1_GCI'
+    cachePath = '/home/solcia/Documents/phd/CFDcases/AM1_GCI/cache'
+
+    times = timeDirectories(casePaths[0])[1:]
+
+    for fieldName in ['p', 'U']:
+        computeFieldGCI(casePaths, fieldName, times, outputPath, cachePath)
@@ -83,7 +83,7 @@ def getLargestRegion(poly):
     
     return largestRegion
 
-def applyPolyFilter(poly):
+def applyPolyFilter(poly, numberOfIterations=100, passBand=0.25, featureAngle=120.0):
 
     """Function that apply a surface vtk poly data filter. 
 
@@ -91,6 +91,12 @@ def applyPolyFilter(poly):
     ----------
     poly: vtkPolyData
         vtk data object that represents a geometric structure with vertices, lines, polygons...
+    numberOfIterations: int
+        Number of windowed sinc iterations.
+    passBand: float
+        Pass band of the windowed sinc filter.
+    featureAngle: float
+        Feature angle of the windowed sinc filter.
 
     Returns
     -------
@@ -99,14 +105,11 @@ def applyPolyFilter(poly):
 
     """
 
-    #These are parameters that worked fine for most of my applications.
+    #The default parameters worked fine for most of my applications.
     #However, if you are having shrinking problems: 
     #-First, I would consider a higher passBand (e. g., 0.3, 0.4, 0.5, etc...).
     #-Second, with a different passBand, I would increase the numberOfIterations
     #and gradually decrease that number (but never going less than 100 iterations).
-    numberOfIterations = 100
-    passBand = 0.25
-    featureAngle = 120.0
     
     polyFilter = vtk.vtkWindowedSincPolyDataFilter()
     polyFilter.SetInputData(poly)
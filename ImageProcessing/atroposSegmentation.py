@@ -8,9 +8,116 @@ import os
 import ants
 import numpy as np
 import SimpleITK as sitk
-import matplotlib.pyplot as plt
+from imageInterop import sitkToAnts, getMetadata, writeArray
 
-def createSigmoidMask(image):
+def intensityHistogram(array, bins=256, fraction=1.0):
+
+    """Intensity histogram with the same bins as np.histogram (and plt.hist) on the whole array. Integer
+    images are counted with np.bincount over the intensity range, other types with np.histogram. The
+    range is kept in the input dtype (as np.histogram does), so float32 images get float32 edges.
+
+    Parameters
+    -----------
+    array: array
+        Intensity array (e.g. from sitk.GetArrayViewFromImage).
+    bins: int
+        Number of bins.
+    fraction: float
+        Fraction of voxels used (strided subsample), 1 uses every voxel.
+
+    Returns
+    --------
+    frequency: array
+        Counts of each bin.
+    edges: array
+        Bin edges.
+
+    """
+
+    flattenIntensityArray = np.asarray(array).reshape(-1)
+    minimum, maximum = flattenIntensityArray.min(), flattenIntensityArray.max()
+
+    if fraction<1:
+        flattenIntensityArray = flattenIntensityArray[::max(int(round(1/fraction)), 1)]
+
+    if not np.issubdtype(flattenIntensityArray.dtype, np.integer) or minimum==maximum:
+        return np.histogram(flattenIntensityArray, bins=bins, range=(minimum, maximum))
+
+    edges = np.linspace(float(minimum), float(maximum), bins+1)
+
+    counts = np.bincount((flattenIntensityArray.astype(np.int64)-int(minimum)).reshape(-1))
+    values = float(minimum)+np.arange(len(counts))
+
+    index = np.minimum(((values-edges[0])*(bins/(edges[-1]-edges[0]))).astype(np.int64), bins-1)
+    index -= values<edges[index]
+    index += (values>=edges[index+1])&(index!=bins-1)
+
+    frequency = np.bincount(index, weights=counts, minlength=bins).astype(np.int64)
+
+    return frequency, edges
+
+def estimateSigmoidBeta(image, bins=256, fraction=1.0):
+
+    """Sigmoid beta as the modal intensity bin edge of non-zero values (first and last bins are
+    ignored).
+
+    Parameters
+    -----------
+    image: sitkImage
+        We expect an sitkImage from sitkReadImage.
+    bins: int
+        Number of histogram bins.
+    fraction: float
+        Fraction of voxels used on the histogram.
+
+    Returns
+    --------
+    beta: float
+        Sigmoid beta value.
+
+    """
+
+    frequency, edges = intensityHistogram(sitk.GetArrayViewFromImage(image), bins, fraction)
+
+    beta = edges[frequency[1:-1].argmax()+1] # non-zero values
+
+    return float(beta)
+
+def applySigmoidMask(image, beta, alpha=1.0, outputMinimum=0, outputMaximum=1):
+
+    """Sigmoid mask using sitk filter.
+
+    Parameters
+    -----------
+    image: sitkImage
+        Input image.
+    beta: float
+        Sigmoid center intensity.
+    alpha: float
+        Sigmoid width.
+    outputMinimum: float
+        Mask minimum value.
+    outputMaximum: float
+        Mask maximum value.
+
+    Returns
+    --------
+    sigmoidMask: sitkImage
+        Sigmoid mask.
+
+    """
+
+    sigmoidFilter = sitk.SigmoidImageFilter()
+    sigmoidFilter.SetOutputMinimum(outputMinimum)
+    sigmoidFilter.SetOutputMaximum(outputMaximum)
+    sigmoidFilter.SetAlpha(alpha)
+    sigmoidFilter.SetBeta(beta)
+    
+    sigmoidMask = sigmoidFilter.Execute(image)
+
+    return sigmoidMask
+
+def createSigmoidMask(image, fraction=1.0):
 
     """Creates sigmoid mask using sitk filter.
 
@@ -18,6 +125,8 @@ def createSigmoidMask(image):
     -----------
     image: sitkImage
         We expect an sitkImage from sitkReadImage.
+    fraction: float
+        Fraction of voxels used to estimate beta (1 uses every voxel).
 
     Returns
     --------
@@ -31,17 +140,9 @@ def createSigmoidMask(image):
     MIN = 0
     ALPHA = 1.0
 
-    flattenIntensityArray = sitk.GetArrayViewFromImage(image).reshape(-1)
-    frequency, bins, _ = plt.hist(flattenIntensityArray, bins=256)
-    beta = bins[frequency[1:-1].argmax()+1] # non-zero values
-    
-    sigmoidFilter = sitk.SigmoidImageFilter()
-    sigmoidFilter.SetOutputMinimum(MIN)
-    sigmoidFilter.SetOutputMaximum(MAX)
-    sigmoidFilter.SetAlpha(ALPHA)
-    sigmoidFilter.SetBeta(beta)
-    
-    sigmoidMask = sigmoidFilter.Execute(image)
+    beta = estimateSigmoidBeta(image, fraction=fraction)
+
+    sigmoidMask = applySigmoidMask(image, beta, ALPHA, MIN, MAX)
 
     return sigmoidMask
 
@@ -64,8 +165,7 @@ def convertSitkToAnts(sitkImage):
 
     """
 
-    array = sitk.GetArrayFromImage(sitkImage)
-    antsImage = ants.from_numpy(array.astype('float32'))
+    antsImage, _ = sitkToAnts(sitkImage)
 
     return antsImage
 
@@ -110,12 +210,7 @@ def writeArrayImage(dataPath, sitkImage, array):
 
     """
 
-    newSitkImage = sitk.GetImageFromArray(array)
-    newSitkImage.CopyInformation(sitkImage)
-
-    standard_writer = sitk.ImageFileWriter()
-    standard_writer.SetFileName(dataPath)
-    standard_writer.Execute(newSitkImage)
+    writeArray(dataPath, array, getMetadata(sitkImage))
 
 
 
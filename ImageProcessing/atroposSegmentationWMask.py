@@ -9,6 +9,7 @@ import os
 import ants
 import numpy as np
 import SimpleITK as sitk
+from imageInterop import sitkToAnts, getMetadata, writeArray
 import matplotlib.pyplot as plt
 
 def convertSitkToAnts(sitkImage):
@@ -29,8 +30,7 @@ def convertSitkToAnts(sitkImage):
 
     """
 
-    array = sitk.GetArrayFromImage(sitkImage)
-    antsImage = ants.from_numpy(array.astype('float32'))
+    antsImage, _ = sitkToAnts(sitkImage)
 
     return antsImage
 
@@ -75,12 +75,7 @@ def writeArrayImage(dataPath, sitkImage, array):
 
     """
 
-    newSitkImage = sitk.GetImageFromArray(array)
-    newSitkImage.CopyInformation(sitkImage)
-
-    standard_writer = sitk.ImageFileWriter()
-    standard_writer.SetFileName(dataPath)
-    standard_writer.Execute(newSitkImage)
+    writeArray(dataPath, array, getMetadata(sitkImage))
 
 
 
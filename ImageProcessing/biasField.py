@@ -1,14 +1,19 @@
 # Author: Gustavo Solcia
 # E-mail: gustavo.solcia@usp.br
 
-"""Wrapper of N4 bias field correction with shrinking from SimpleITK.
+"""Wrapper of N4 bias field correction with shrinking from SimpleITK. The multi-level mode keeps the
+   log bias field as its B-spline control point lattice (a small .npz file), evaluates it on the full
+   resolution image slab by slab and can reuse or warm-start from a field fitted on a previous
+   acquisition from the same coil.
 
 """
 
 import os
+import numpy as np
 import SimpleITK as sitk
+from scipy.interpolate import BSpline
 
-def shrinkBiasCorrection(inputImage):
+def shrinkBiasCorrection(inputImage, shrinkFactor=4):
 
     """Bias field correction with shrinking operation.
 
@@ -16,6 +21,8 @@ def shrinkBiasCorrection(inputImage):
     -----------
     inputImage: sitkImage
         We expect an sitkImage from sitk.ReadImage.
+    shrinkFactor: int
+        Shrinking factor (must be a integer factor).
 
     Returns
     --------
@@ -26,8 +33,6 @@ def shrinkBiasCorrection(inputImage):
 
     """
 
-    shrinkFactor = 4 # Must be a integer factor
-
     # Using sitk.Shrink reduces the processing time and gives good results
     shrinkedImage = sitk.Shrink(inputImage, [shrinkFactor]*inputImage.GetDimension())
     
@@ -40,6 +45,252 @@ def shrinkBiasCorrection(inputImage):
 
     return dataWithoutBias, bias
 
+def bsplineBasis(n, numberOfControlPoints, splineOrder=3):
+    """Uniform B-spline basis mapping n voxels to the control points of one axis. The first and last
+    voxel centres are mapped to the ends of the parametric domain, the same mapping used by
+    N4BiasFieldCorrectionImageFilter.GetLogBiasFieldAsImage for any reference image (the lattice
+    fitted on the shrinked image is stretched over the extent of the full resolution image).
+
+    Parameters
+    -----------
+    n: int
+        Number of voxels along the axis.
+    numberOfControlPoints: int
+        Number of control points along the axis.
+    splineOrder: int
+        B-spline order.
+
+    Returns
+    --------
+    basis: array
+        Basis matrix (n, numberOfControlPoints).
+
+    """
+
+    span = numberOfControlPoints-splineOrder
+    knots = np.arange(-splineOrder, numberOfControlPoints+1, dtype=float)
+    u = np.linspace(0, span, n) if n>1 else np.zeros(1)
+
+    return BSpline.design_matrix(u, knots, splineOrder).toarray()
+
+def fitLattice(logBias, numberOfControlPoints, splineOrder=3):
+    """Control point lattice reproducing a log bias field sampled on the grid it was fitted on
+    (least squares with the separable basis of each axis).
+
+    Parameters
+    -----------
+    logBias: array
+        Log bias field (numpy axis order).
+    numberOfControlPoints: int
+        Number of control points along each axis.
+    splineOrder: int
+        B-spline order.
+
+    Returns
+    --------
+    lattice: array
+        Control point lattice (numpy axis order).
+
+    """
+
+    if min(logBias.shape)<numberOfControlPoints:
+        raise ValueError('Shrinked image '+str(logBias.shape)+' is smaller than the lattice of '+
+                str(numberOfControlPoints)+' control points, use a smaller shrinkFactor or fewer levels.')
+
+    pseudoInverses = [np.linalg.pinv(bsplineBasis(n, numberOfControlPoints, splineOrder)) for n in logBias.shape]
+
+    return np.einsum('ai,bj,ck,ijk->abc', *pseudoInverses, logBias, optimize=True)
+
+def evaluateLogBiasField(field, shape, start=0, stop=None):
+    """Log bias field on slices [start, stop) (first numpy axis) of an image with the given shape.
+
+    Parameters
+    -----------
+    field: dict
+        Control point lattice and spline order (from multiLevelBiasCorrection or loadBiasField).
+    shape: tuple
+        Image shape (numpy axis order).
+    start: int
+        First slice.
+    stop: int
+        Last slice (exclusive), None for the last slice of the image.
+
+    Returns
+    --------
+    logBias: array
+        Log bias field (stop-start, shape[1], shape[2]).
+
+    """
+
+    lattice = field['lattice']
+    splineOrder = int(field['splineOrder'])
+    stop = shape[0] if stop is None else stop
+
+    basis = [bsplineBasis(n, m, splineOrder) for n, m in zip(shape, lattice.shape)]
+
+    return np.einsum('ia,jb,kc,abc->ijk', basis[0][start:stop], basis[1], basis[2], lattice, optimize=True)
+
+def multiLevelBiasCorrection(inputImage, shrinkFactor=4, iterations=(50, 50, 50, 50),
+        convergenceThreshold=0.001, numberOfControlPoints=4, splineOrder=3, initialField=None, slabSize=16,
+        check=False, checkTolerance=1e-3):
+
+    """Multi-level (coarse-to-fine control point lattice) N4 bias field correction with shrinking.
+
+    Parameters
+    -----------
+    inputImage: sitkImage
+        We expect an sitkImage from sitk.ReadImage.
+    shrinkFactor: int
+        Shrinking factor (must be a integer factor).
+    iterations: List
+        Maximum number of iterations for each fitting level (the lattice resolution doubles at each level).
+    convergenceThreshold: float
+        Convergence threshold of each level.
+    numberOfControlPoints: int
+        Number of control points of the first level.
+    splineOrder: int
+        B-spline order.
+    initialField: dict
+        Field from a previous acquisition (loadBiasField). The image is corrected with it before N4 and
+        the fitted residual lattice is added to it (both must have the same lattice size).
+    slabSize: int
+        Number of slices corrected at once on full resolution.
+    check: bool
+        Compares the evaluated field with GetLogBiasFieldAsImage(inputImage) (see checkLogBiasField,
+        skipped with initialField).
+    checkTolerance: float
+        Maximum absolute log bias difference of the check.
+
+    Returns
+    --------
+    dataWithoutBias: sitkImage
+        Reconstructed data (not shrinked, float32) without bias.
+    field: dict
+        Log bias field control point lattice (save it with saveBiasField).
+
+    """
+
+    shrinkedImage = sitk.Cast(sitk.Shrink(inputImage, [shrinkFactor]*inputImage.GetDimension()), sitk.sitkFloat32)
+
+    if initialField is not None:
+        shrinkedArray = sitk.GetArrayFromImage(shrinkedImage)
+        shrinkedArray /= np.exp(evaluateLogBiasField(initialField, shrinkedArray.shape)).astype(np.float32)
+        correctedImage = sitk.GetImageFromArray(shrinkedArray)
+        correctedImage.CopyInformation(shrinkedImage)
+        shrinkedImage = correctedImage
+
+    biasFilter = sitk.N4BiasFieldCorrectionImageFilter()
+    biasFilter.SetMaximumNumberOfIterations([int(i) for i in iterations])
+    biasFilter.SetConvergenceThreshold(convergenceThreshold)
+    biasFilter.SetNumberOfControlPoints([numberOfControlPoints]*inputImage.GetDimension())
+    biasFilter.SetSplineOrder(splineOrder)
+    biasFilter.Execute(shrinkedImage)
+
+    # SimpleITK does not expose the lattice, it is recovered from the field on the fitted grid (the
+    # number of control points doubles its spans at each level)
+    numberOfLatticePoints = (numberOfControlPoints-splineOrder)*2**(len(iterations)-1)+splineOrder
+    lattice = fitLattice(sitk.GetArrayFromImage(biasFilter.GetLogBiasFieldAsImage(shrinkedImage)).astype(np.float64),
+            numberOfLatticePoints, splineOrder)
+
+    if initialField is not None:
+        if initialField['lattice'].shape!=lattice.shape:
+            raise ValueError('Initial field lattice '+str(initialField['lattice'].shape)+
+                    ' does not match the fitted lattice '+str(lattice.shape)+'.')
+        lattice = lattice+initialField['lattice']
+
+    field = {'lattice': lattice, 'splineOrder': splineOrder}
+
+    if check and initialField is None:
+        checkLogBiasField(field, biasFilter, inputImage, checkTolerance)
+
+    dataWithoutBias = applyBiasField(inputImage, field, slabSize)
+
+    return dataWithoutBias, field
+
+def checkLogBiasField(field, biasFilter, referenceImage, tol=1e-3):
+    """Compares the log bias field evaluated from the lattice with
+    biasFilter.GetLogBiasFieldAsImage(referenceImage). The ITK field is allocated at full resolution,
+    use it only to validate a setup.
+
+    Parameters
+    -----------
+    field: dict
+        Log bias field control point lattice.
+    biasFilter: N4BiasFieldCorrectionImageFilter
+        Filter the lattice was fitted with.
+    referenceImage: sitkImage
+        Image the field is evaluated on.
+    tol: float
+        Maximum absolute difference.
+
+    Returns
+    --------
+    difference: float
+        Maximum absolute difference.
+
+    """
+
+    logBias = sitk.GetArrayFromImage(biasFilter.GetLogBiasFieldAsImage(referenceImage))
+
+    difference = np.abs(evaluateLogBiasField(field, logBias.shape)-logBias).max()
+
+    if not difference<=tol:
+        raise ValueError('Log bias field differs from GetLogBiasFieldAsImage by '+str(difference)+'.')
+
+    return difference
+
+def applyBiasField(inputImage, field, slabSize=16):
+
+    """Divides the image by the bias field, evaluated from the control point lattice slab by slab.
+    Each corrected slab is pasted in place into the preallocated output image, so besides the output
+    only one slab of the field and of the result is allocated at once. No integer cast is applied to
+    the result.
+
+    Parameters
+    -----------
+    inputImage: sitkImage
+        Image with bias.
+    field: dict
+        Log bias field control point lattice.
+    slabSize: int
+        Number of slices corrected at once.
+
+    Returns
+    --------
+    dataWithoutBias: sitkImage
+        float32 image without bias.
+
+    """
+
+    data = sitk.GetArrayViewFromImage(inputImage)
+
+    dataWithoutBias = sitk.Image(inputImage.GetSize(), sitk.sitkFloat32)
+    dataWithoutBias.CopyInformation(inputImage)
+
+    for start in range(0, data.shape[0], slabSize):
+        stop = min(start+slabSize, data.shape[0])
+        slab = np.divide(data[start:stop], np.exp(evaluateLogBiasField(field, data.shape, start, stop)),
+                dtype=np.float32)
+        dataWithoutBias[:,:,start:stop] = sitk.GetImageFromArray(slab)
+
+    return dataWithoutBias
+
+def saveBiasField(fileName, field):
+
+    """Saves the log bias field control point lattice as compressed .npz.
+
+    """
+
+    np.savez_compressed(fileName, lattice=field['lattice'], splineOrder=field['splineOrder'])
+
+def loadBiasField(fileName):
+
+    """Loads a log bias field control point lattice saved with saveBiasField.
+
+    """
+
+    with np.load(fileName) as data:
+        return {'lattice': data['lattice'], 'splineOrder': int(data['splineOrder'])}
 
 def writeImage(dataPath, data):
     
@@ -62,11 +313,11 @@ if __name__=='__main__':
     path = os.path.abspath("/home/solcia/Documents/phd/MRI data/rocks/3C/PSIF300/")
     inputName = '/rescaled_3C_cropped.nii.gz'
     outputName = '/biasRemoved_MRIdata.nii.gz' #The forward slash is necessary to path+*Name work!
-    biasName = '/logBiasField_MRIdata.nii.gz'
+    biasName = '/logBiasField_MRIdata.npz'
     
     image = sitk.ReadImage(path+inputName)
     
-    dataWithoutBias, bias = shrinkBiasCorrection(image)
+    dataWithoutBias, field = multiLevelBiasCorrection(image)
 
     writeImage(path+outputName, dataWithoutBias)
-    writeImage(path+biasName, bias)
+    saveBiasField(path+biasName, field)
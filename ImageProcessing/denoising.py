@@ -10,12 +10,17 @@ import sys
 sys.path.append('../../NLM') #ATENTION: This path depends on where you cloned our NLM repository
 
 import os
+import numpy as np
 import SimpleITK as sitk
+from multiprocessing import Pool
+from imageInterop import arrayToSitk, getMetadata
 from modifiedNLM.estimate.noise_estimate import rician_estimate
 from modifiedNLM.filter.modified_nl_means import rician_denoise_nl_means
 
+PATCH_SIZE = 5 # 5x5 patches
+PATCH_DISTANCE = 6 # 13x13 search area
 
-def NLM(imageData):
+def NLM(imageData, fastMode=False, sigma=None):
 
     """Wrapper of modified NLM imported from https://github.com/CIERMag-FFPaivaStudents/NLM.
 
@@ -23,6 +28,10 @@ def NLM(imageData):
     ----------
     imageData: array
         Numpy array from image desired to denoise. Atention: Be shure your image has Rician noise.
+    fastMode: bool
+        Uses the fast (integral image) NLM version.
+    sigma: float
+        Rician noise sigma (default: rician_estimate on the whole image).
 
     Returns
     -------
@@ -31,15 +40,98 @@ def NLM(imageData):
 
     """
 
-    ricianSigma = rician_estimate(imageData)
-    patch_kw = dict(patch_size=5,      # 5x5 patches
-                patch_distance=6,  # 13x13 search area
+    ricianSigma = rician_estimate(imageData) if sigma is None else sigma
+    patch_kw = dict(patch_size=PATCH_SIZE,
+                patch_distance=PATCH_DISTANCE,
                 multichannel=False,
                 preserve_range=True)
-    denoisedData = rician_denoise_nl_means(imageData, h=1.15 * ricianSigma, fast_mode=False,
+    denoisedData = rician_denoise_nl_means(imageData, h=1.15 * ricianSigma, fast_mode=fastMode,
                            **patch_kw)
     return denoisedData
 
+def estimateSigma(imageData, fraction=0.25, slabThickness=8):
+
+    """Rician noise sigma from a subsample of evenly spaced contiguous z-slabs.
+
+    Parameters
+    ----------
+    imageData: array
+        Numpy array from image desired to denoise.
+    fraction: float
+        Approximate fraction of slices used (1 uses the whole image).
+    slabThickness: int
+        Number of contiguous slices of each slab.
+
+    Returns
+    -------
+    ricianSigma: float
+        Estimated sigma.
+
+    """
+
+    nSlices = imageData.shape[0]
+    nSlabs = int(np.ceil(fraction*nSlices/slabThickness))
+
+    if fraction>=1 or nSlabs*slabThickness>=nSlices:
+        return rician_estimate(imageData)
+
+    starts = np.linspace(0, nSlices-slabThickness, nSlabs).astype(int)
+    sample = np.concatenate([imageData[start:start+slabThickness] for start in starts])
+
+    return rician_estimate(sample)
+
+def _denoiseSlab(slab, sigma, fastMode):
+
+    return NLM(slab, fastMode, sigma)
+
+def tiledNLM(imageData, slabSize=32, fastMode=False, sigma=None, fraction=0.25, processes=None):
+
+    """NLM on overlapping z-slabs across worker processes. Each slab is extended by the patch search
+    radius (PATCH_DISTANCE+PATCH_SIZE//2) on both sides, so with the same sigma the slab cores are
+    equal to the monolithic NLM call.
+
+    Parameters
+    ----------
+    imageData: array
+        Numpy array from image desired to denoise. Atention: Be shure your image has Rician noise.
+    slabSize: int
+        Number of slices of each slab core.
+    fastMode: bool
+        Uses the fast (integral image) NLM version.
+    sigma: float
+        Rician noise sigma (default: estimateSigma with fraction).
+    fraction: float
+        Fraction of slices used to estimate sigma.
+    processes: int
+        Number of worker processes (default: number of CPUs).
+
+    Returns
+    -------
+    denoisedData: array
+        Denoised array.
+
+    """
+
+    if sigma is None:
+        sigma = estimateSigma(imageData, fraction)
+
+    halo = PATCH_DISTANCE+PATCH_SIZE//2
+    nSlices = imageData.shape[0]
+
+    starts = range(0, nSlices, slabSize)
+    tasks = [(np.asarray(imageData[max(start-halo, 0):min(start+slabSize+halo, nSlices)]), sigma, fastMode)
+             for start in starts]
+
+    denoisedData = np.empty(imageData.shape, dtype=float)
+
+    with Pool(processes) as pool:
+        for start, denoisedSlab in zip(starts, pool.starmap(_denoiseSlab, tasks)):
+            stop = min(start+slabSize, nSlices)
+            offset = start-max(start-halo, 0)
+            denoisedData[start:stop] = denoisedSlab[offset:offset+stop-start]
+
+    return denoisedData
+
 def createSITKcopy(image, array):
 
     """Create new sitk image from array with same information from base image.
@@ -58,8 +150,7 @@ def createSITKcopy(image, array):
 
     """
     
-    copy = sitk.GetImageFromArray(array)
-    copy.CopyInformation(image)
+    copy = arrayToSitk(array, getMetadata(image))
 
     return copy
 
@@ -88,7 +179,7 @@ if __name__ == '__main__':
 
     imageData = sitk.GetArrayViewFromImage(image)
 
-    denoisedData = NLM(imageData)
+    denoisedData = tiledNLM(imageData)
 
     denoised = createSITKcopy(image, denoisedData)
 
@@ -0,0 +1,184 @@
+# Author: Gustavo Solcia
+# E-mail: gustavo.solcia@usp.br
+
+"""SimpleITK, ANTs and NumPy conversions shared by the ImageProcessing scripts. Arrays are views of
+   the image buffers whenever possible (sitk.GetArrayViewFromImage, antsImage.view), dtype changes
+   are done once and only when needed, and origin/spacing/direction travel as a metadata dict
+   instead of CopyInformation from intermediate images. Every conversion that allocates a new
+   buffer is logged in allocationLog (see allocationReport).
+
+"""
+
+import ants
+import numpy as np
+import SimpleITK as sitk
+
+PIXEL_TYPES = {np.dtype(np.uint8): sitk.sitkUInt8, np.dtype(np.int16): sitk.sitkInt16,
+               np.dtype(np.uint16): sitk.sitkUInt16, np.dtype(np.int32): sitk.sitkInt32,
+               np.dtype(np.float32): sitk.sitkFloat32, np.dtype(np.float64): sitk.sitkFloat64}
+
+allocationLog = []
+
+def _logAllocation(conversion, nbytes):
+
+    allocationLog.append((conversion, int(nbytes)))
+
+def allocationReport(reset=False):
+    """Bytes allocated by the conversions since the last reset.
+
+    Parameters
+    ----------
+    reset: bool
+        Clears the log after reporting.
+
+    Returns
+    -------
+    report: dict
+        Total bytes for each conversion name.
+
+    """
+
+    report = {}
+    for conversion, nbytes in allocationLog:
+        report[conversion] = report.get(conversion, 0)+nbytes
+
+    if reset:
+        del allocationLog[:]
+
+    return report
+
+def getMetadata(sitkImage):
+    """Origin, spacing and direction from sitkImage.
+
+    """
+
+    return {'origin': sitkImage.GetOrigin(),
+            'spacing': sitkImage.GetSpacing(),
+            'direction': sitkImage.GetDirection()}
+
+def setMetadata(sitkImage, metadata):
+    """Sets origin, spacing and direction on sitkImage (in place).
+
+    """
+
+    sitkImage.SetOrigin(metadata['origin'])
+    sitkImage.SetSpacing(metadata['spacing'])
+    sitkImage.SetDirection(metadata['direction'])
+
+    return sitkImage
+
+def sitkToArray(sitkImage, dtype=None):
+    """Read only array view of sitkImage. If dtype differs from the pixel type the image is cast once
+    by SimpleITK and the view is taken from the cast image.
+
+    Parameters
+    -----------
+    sitkImage: sitkImage
+        Input image.
+    dtype: dtype
+        Desired array type (None keeps the pixel type).
+
+    Returns
+    --------
+    array: array
+        Array view (numpy axis order).
+    owner: sitkImage
+        Image that owns the buffer, it must be kept alive while the view is used.
+
+    """
+
+    owner = sitkImage
+    array = sitk.GetArrayViewFromImage(owner)
+
+    if dtype is not None and array.dtype!=np.dtype(dtype):
+        owner = sitk.Cast(sitkImage, PIXEL_TYPES[np.dtype(dtype)])
+        array = sitk.GetArrayViewFromImage(owner)
+        _logAllocation('sitkCast', array.nbytes)
+
+    return array, owner
+
+def arrayToAnts(array):
+    """antsImage from array. ANTs copies the data once, the float32 cast is skipped when the array
+    already is float32.
+
+    """
+
+    array = np.asarray(array)
+    if array.dtype!=np.float32:
+        array = array.astype(np.float32)
+        _logAllocation('float32Cast', array.nbytes)
+
+    antsImage = ants.from_numpy(array)
+    _logAllocation('antsImage', array.nbytes)
+
+    return antsImage
+
+def sitkToAnts(sitkImage):
+    """antsImage from sitkImage (same axis convention as convertSitkToAnts). The cast to float32 is done
+    by SimpleITK only when needed and ANTs copies from the view.
+
+    Parameters
+    -----------
+    sitkImage: sitkImage
+        Image desired to convert.
+
+    Returns
+    --------
+    antsImage: antsImage
+        Converted image.
+    metadata: dict
+        Origin, spacing and direction of sitkImage.
+
+    """
+
+    array, owner = sitkToArray(sitkImage, np.float32)
+
+    antsImage = arrayToAnts(array)
+
+    return antsImage, getMetadata(sitkImage)
+
+def antsToArray(antsImage):
+    """Array view of the antsImage buffer (no copy). The antsImage must be kept alive while the view
+    is used, use antsImage.numpy() for an independent copy.
+
+    """
+
+    return antsImage.view()
+
+def arrayToSitk(array, metadata):
+    """sitkImage from array with the given metadata (one copy into the ITK buffer).
+
+    Parameters
+    ----------
+    array: array
+        Array (numpy axis order).
+    metadata: dict
+        Origin, spacing and direction (from getMetadata).
+
+    Returns
+    -------
+    sitkImage: sitkImage
+        New image.
+
+    """
+
+    sitkImage = sitk.GetImageFromArray(array)
+    _logAllocation('sitkImage', np.asarray(array).nbytes)
+
+    return setMetadata(sitkImage, metadata)
+
+def writeArray(dataPath, array, metadata):
+    """Writes array as image with the given metadata.
+
+    Parameters
+    ----------
+    dataPath: string
+        String containing a path to the directory + the data name.
+    array: array
+        Numpy array you want to save.
+    metadata: dict
+        Origin, spacing and direction (from getMetadata).
+
+    """
+
+    sitk.WriteImage(arrayToSitk(array, metadata), dataPath)
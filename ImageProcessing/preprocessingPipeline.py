@@ -0,0 +1,243 @@
+# Author: Gustavo Solcia
+# E-mail: gustavo.solcia@usp.br
+
+"""MRI preprocessing pipeline (bias field correction -> denoising -> segmentation -> 3D reconstruction)
+   chained in memory. Each stage output is cached on disk with a key from the input content hash, the
+   parameters of the stage and the keys of the previous stages, so changing only the marching cubes
+   threshold reuses the N4 and NLM results. Samples run concurrently on a process pool.
+
+"""
+
+import os
+import json
+import hashlib
+import importlib
+import numpy as np
+import SimpleITK as sitk
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk
+from multiprocessing import Pool
+from biasField import shrinkBiasCorrection
+from denoising import NLM
+from atroposSegmentation import createSigmoidMask, convertSitkToAnts, getSegmentationArray
+from imageInterop import arrayToSitk, getMetadata
+
+recon = importlib.import_module('3dRecon')
+
+DEFAULT_PARAMETERS = {'bias': {'shrinkFactor': 4},
+                      'denoise': {},
+                      'segment': {'fraction': 1.0},
+                      'surface': {'threshold': 2.5, 'transformCoord': True, 'numberOfIterations': 100,
+                                  'passBand': 0.25, 'featureAngle': 120.0}}
+
+def fileHash(fileName, blockSize=2**20):
+    """sha256 of a file content.
+
+    """
+
+    sha = hashlib.sha256()
+
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def stageKey(stage, inputKey, params):
+    """Cache key from stage name, input key and stage parameters.
+
+    """
+
+    text = json.dumps([stage, inputKey, params], sort_keys=True)
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def biasStage(image, shrinkFactor=4):
+    """Bias field correction stage (biasField.py).
+
+    """
+
+    dataWithoutBias, _ = shrinkBiasCorrection(image, shrinkFactor)
+
+    return dataWithoutBias
+
+def denoiseStage(image):
+    """Non-Local Means denoising stage (denoising.py).
+
+    """
+
+    return arrayToSitk(NLM(sitk.GetArrayViewFromImage(image)), getMetadata(image))
+
+def segmentStage(image, fraction=1.0):
+    """Atropos segmentation stage with sigmoid mask (atroposSegmentation.py).
+
+    """
+
+    sigmoidMask = createSigmoidMask(sitk.Cast(image, sitk.sitkInt16), fraction)
+
+    segmentationArray = getSegmentationArray(convertSitkToAnts(image), convertSitkToAnts(sigmoidMask))
+
+    return arrayToSitk(segmentationArray.astype(np.uint8), getMetadata(image))
+
+def sitkToVtk(image):
+    """vtkImageData and QForm like matrix (RAS, as from vtkNIFTIImageReader) from sitkImage.
+
+    Parameters
+    ----------
+    image: sitkImage
+        3D scalar image.
+
+    Returns
+    -------
+    vtkImage: vtkImageData
+        Image with the same spacing and origin at zero.
+    QFormMatrix: vtkMatrix4x4
+        Voxel (scaled by spacing) to RAS world matrix.
+
+    """
+
+    array = sitk.GetArrayFromImage(image)
+
+    vtkImage = vtk.vtkImageData()
+    vtkImage.SetDimensions(image.GetSize())
+    vtkImage.SetSpacing(image.GetSpacing())
+    vtkImage.SetOrigin(0, 0, 0)
+    vtkImage.GetPointData().SetScalars(numpy_to_vtk(array.reshape(-1), deep=True))
+
+    matrix = np.eye(4)
+    matrix[:3,:3] = np.reshape(image.GetDirection(), (3, 3))
+    matrix[:3,3] = image.GetOrigin()
+    matrix[:2] *= -1 # LPS (sitk) to RAS (nifti)
+
+    QFormMatrix = vtk.vtkMatrix4x4()
+    for i in range(4):
+        for j in range(4):
+            QFormMatrix.SetElement(i, j, matrix[i,j])
+
+    return vtkImage, QFormMatrix
+
+def surfaceStage(image, threshold=2.5, transformCoord=True, numberOfIterations=100, passBand=0.25, featureAngle=120.0):
+    """Marching cubes and smoothing stage (3dRecon.py).
+
+    """
+
+    vtkImage, QFormMatrix = sitkToVtk(image)
+
+    mcPoly = recon.applyMarchingCubes(vtkImage, threshold, transformCoord, QFormMatrix)
+
+    polyFiltered = recon.applyPolyFilter(mcPoly, numberOfIterations, passBand, featureAngle)
+
+    return mcPoly, polyFiltered
+
+def writeImageOutput(cacheName, image):
+    """Writes an image stage output.
+
+    """
+
+    sitk.WriteImage(image, cacheName+'.nii.gz')
+
+def writeSurfaceOutput(cacheName, surfaces):
+    """Writes the marching cubes and smooth surfaces of the surface stage.
+
+    """
+
+    for suffix, poly in zip(('_cubes', '_smooth'), surfaces):
+        recon.writeSTL(cacheName, suffix+'.stl', poly)
+
+STAGES = [('bias', biasStage, writeImageOutput, ['.nii.gz']),
+          ('denoise', denoiseStage, writeImageOutput, ['.nii.gz']),
+          ('segment', segmentStage, writeImageOutput, ['.nii.gz']),
+          ('surface', surfaceStage, writeSurfaceOutput, ['_cubes.stl', '_smooth.stl'])]
+
+def runSample(inputName, cachePath, parameters=None):
+    """Runs the pipeline for a single image. Cached stages are skipped, and a cached output is only
+    read when a later stage has to run.
+
+    Parameters
+    ----------
+    inputName: str
+        Input image file.
+    cachePath: str
+        Stage cache directory.
+    parameters: dict
+        Parameters of each stage (missing values from DEFAULT_PARAMETERS).
+
+    Returns
+    -------
+    outputs: dict
+        Output file names for each stage.
+
+    """
+
+    parameters = {stage: dict(DEFAULT_PARAMETERS[stage], **(parameters or {}).get(stage, {}))
+                  for stage in DEFAULT_PARAMETERS}
+
+    os.makedirs(cachePath, exist_ok=True)
+
+    key = fileHash(inputName)
+    image = None
+    source = inputName
+
+    outputs = {}
+    for stage, function, writer, extensions in STAGES:
+        key = stageKey(stage, key, parameters[stage])
+        cacheName = os.path.join(cachePath, stage+'_'+key)
+        outputs[stage] = [cacheName+extension for extension in extensions]
+
+        if all(os.path.exists(output) for output in outputs[stage]):
+            image, source = None, outputs[stage][0]
+            continue
+
+        if image is None:
+            image = sitk.ReadImage(source)
+
+        result = function(image, **parameters[stage])
+
+        # outputs are written under a temporary name and moved in place, so an interrupted write
+        # never leaves a truncated file that looks cached
+        temporaryName = cacheName+'.tmp{}'.format(os.getpid())
+        writer(temporaryName, result)
+        for extension, output in zip(extensions, outputs[stage]):
+            os.replace(temporaryName+extension, output)
+
+        image = result
+
+    return outputs
+
+def runPipeline(inputNames, cachePath, parameters=None, processes=None):
+    """Runs the pipeline for many images on a process pool.
+
+    Parameters
+    ----------
+    inputNames: list
+        Input image files.
+    cachePath: str
+        Stage cache directory (shared by the samples).
+    parameters: dict
+        Parameters of each stage.
+    processes: int
+        Number of worker processes (default: number of CPUs).
+
+    Returns
+    -------
+    outputs: dict
+        Output file names of each stage for each input.
+
+    """
+
+    with Pool(processes) as pool:
+        results = pool.starmap(runSample, [(inputName, cachePath, parameters) for inputName in inputNames])
+
+    return dict(zip(inputNames, results))
+
+if __name__=='__main__':
+
+    samples = ['3A', '3B', '3C']
+    inputNames = [os.path.abspath('/home/solcia/Documents/phd/MRI data/rocks/'+sample+'/PSIF300/rescaled_'+sample+'_cropped.nii.gz')
+                  for sample in samples]
+    cachePath = os.path.abspath('/home/solcia/Documents/phd/MRI data/rocks/pipelineCache')
+
+    outputs = runPipeline(inputNames, cachePath, {'surface': {'threshold': 2.5}})
+
+    for inputName, stageOutputs in outputs.items():
+        print(inputName, stageOutputs['surface'])
@@ -0,0 +1,158 @@
+# Author: Gustavo Solcia
+# E-mail: gustavo.solcia@usp.br
+
+"""Parameter sweep for the 3D reconstruction (3dRecon.py). The segmentation image is read once and
+   marching cubes (and the largest region extraction) runs once per threshold before the pool starts,
+   the worker processes inherit those surfaces and each (threshold, pass band, iterations) variant is
+   smoothed as its own task. Volume, surface area and shrinkage (volume change from the marching
+   cubes surface) are reported for each variant.
+
+"""
+
+import os
+import itertools
+import importlib
+import vtk
+import pandas as pd
+from multiprocessing import get_context
+
+recon = importlib.import_module('3dRecon')
+
+def surfaceProperties(poly):
+    """Volume and surface area of a closed vtkPolyData surface.
+
+    Parameters
+    ----------
+    poly: vtkPolyData
+        Triangulated surface.
+
+    Returns
+    -------
+    volume: float
+        Enclosed volume.
+    area: float
+        Surface area.
+
+    """
+
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputData(poly)
+    triangles.Update()
+
+    massProperties = vtk.vtkMassProperties()
+    massProperties.SetInputData(triangles.GetOutput())
+    massProperties.Update()
+
+    return massProperties.GetVolume(), massProperties.GetSurfaceArea()
+
+def _initWorker(surfaces, outputPath):
+
+    global _surfaces, _outputPath
+    _surfaces = surfaces
+    _outputPath = outputPath
+
+def smoothVariant(threshold, passBand, numberOfIterations):
+    """Smoothing of the marching cubes surface of one threshold.
+
+    Parameters
+    ----------
+    threshold: float
+        Marching cubes threshold.
+    passBand: float
+        Windowed sinc pass band.
+    numberOfIterations: int
+        Windowed sinc number of iterations.
+
+    Returns
+    -------
+    row: dict
+        Volume, area and shrinkage of the variant.
+
+    """
+
+    mcPoly, mcVolume = _surfaces[threshold]
+
+    smoothPoly = recon.applyPolyFilter(mcPoly, numberOfIterations, passBand)
+    volume, area = surfaceProperties(smoothPoly)
+
+    if _outputPath is not None:
+        recon.writeSTL(_outputPath, '/smooth_{:g}_{:g}_{:d}.stl'.format(threshold, passBand, numberOfIterations),
+                smoothPoly)
+
+    return {'threshold': threshold, 'passBand': passBand, 'numberOfIterations': numberOfIterations,
+            'volume': volume, 'area': area, 'shrinkage': 1-volume/mcVolume}
+
+def runSweep(inputPath, inputName, thresholds, passBands, iterations, transformCoord=True, outputPath=None,
+        processes=None):
+    """Evaluates the grid of thresholds, pass bands and iterations with a single image read.
+
+    Parameters
+    ----------
+    inputPath: string
+        String containing a path to the data directory
+    inputName: string
+        String containing the data or sample name
+    thresholds: list
+        Marching cubes thresholds.
+    passBands: list
+        Windowed sinc pass bands.
+    iterations: list
+        Windowed sinc numbers of iterations.
+    transformCoord: bool
+        Applies the QForm transform (see applyMarchingCubes).
+    outputPath: string
+        Directory for the stl of every variant (None writes nothing).
+    processes: int
+        Number of worker processes (default: number of CPUs).
+
+    Returns
+    -------
+    results: DataFrame
+        Volume, area and shrinkage of each variant.
+
+    """
+
+    image, QFormMatrix = recon.readImage(inputPath, inputName)
+
+    if outputPath is not None:
+        os.makedirs(outputPath, exist_ok=True)
+
+    surfaces = {}
+    rows = []
+    for threshold in thresholds:
+        # applyMarchingCubes changes the matrix in place, so every call gets its own copy
+        thresholdMatrix = vtk.vtkMatrix4x4()
+        thresholdMatrix.DeepCopy(QFormMatrix)
+
+        mcPoly = recon.applyMarchingCubes(image, threshold, transformCoord, thresholdMatrix)
+        mcVolume, mcArea = surfaceProperties(mcPoly)
+        surfaces[threshold] = (mcPoly, mcVolume)
+
+        rows.append({'threshold': threshold, 'passBand': None, 'numberOfIterations': 0,
+                     'volume': mcVolume, 'area': mcArea, 'shrinkage': 0.0})
+
+        if outputPath is not None:
+            recon.writeSTL(outputPath, '/cubes_{:g}.stl'.format(threshold), mcPoly)
+
+    tasks = list(itertools.product(thresholds, passBands, iterations))
+
+    # vtk objects can not be pickled, the workers inherit the surfaces (fork) through the initializer
+    context = get_context('fork')
+    with context.Pool(processes, initializer=_initWorker, initargs=(surfaces, outputPath)) as pool:
+        rows += pool.starmap(smoothVariant, tasks)
+
+    return pd.DataFrame(rows)
+
+if __name__=='__main__':
+
+    sample = '3C'
+    inputPath = os.path.abspath('/home/solcia/Documents/phd/MRI data/rocks/'+sample+'/PSIF300/')
+    outputPath = os.path.abspath('/home/solcia/Documents/phd/3DModels/rocks/'+sample+'/sweep/')
+    inputName = '/Atropos_'+sample+'.nii.gz'
+
+    results = runSweep(inputPath, inputName, thresholds=[1.5, 2.0, 2.5],
+                       passBands=[0.25, 0.3, 0.4, 0.5], iterations=[100, 200], outputPath=outputPath)
+
+    results.to_csv(outputPath+'/sweep_'+sample+'.csv', index=False)
+
+    print(results)
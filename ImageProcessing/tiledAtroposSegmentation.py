@@ -0,0 +1,284 @@
+# Author: Gustavo Solcia
+# E-mail: gustavo.solcia@usp.br
+
+"""Tiled atropos segmentation (ANTs) for volumes that do not fit in memory (e.g. porous media MRI).
+   The volume is split in overlapping blocks that are read from file region by region on a worker
+   pool, so each worker only holds its own block. Blocks share the class centers (k-means over a
+   strided subsample of the whole volume) used to initialize atropos, and block labels are matched
+   to the labels already written on the overlaps before their core is stitched into a memory-mapped
+   label volume.
+
+"""
+import os
+import ants
+import numpy as np
+import SimpleITK as sitk
+from multiprocessing import Pool
+from scipy.optimize import linear_sum_assignment
+from atroposSegmentation import intensityHistogram, applySigmoidMask
+from imageInterop import arrayToAnts, antsToArray
+
+def blockRegions(size, blockSize, overlap):
+    """Core and read (core + overlap) regions covering an image.
+
+    Parameters
+    ----------
+    size: List
+        Image size (sitk index order).
+    blockSize: List
+        Core block size.
+    overlap: int
+        Overlap (voxels) added to each side of the core.
+
+    Returns
+    -------
+    regions: List
+        (coreIndex, coreSize, readIndex, readSize) for each block.
+
+    """
+
+    starts = [range(0, n, b) for n, b in zip(size, blockSize)]
+
+    regions = []
+    for z in starts[2]:
+        for y in starts[1]:
+            for x in starts[0]:
+                coreIndex = [x, y, z]
+                coreSize = [min(b, n-s) for s, b, n in zip(coreIndex, blockSize, size)]
+                readIndex = [max(s-overlap, 0) for s in coreIndex]
+                readSize = [min(s+c+overlap, n)-r for s, c, r, n in zip(coreIndex, coreSize, readIndex, size)]
+                regions.append((coreIndex, coreSize, readIndex, readSize))
+
+    return regions
+
+def readRegion(fileName, index, size):
+    """Reads only an image region from file.
+
+    """
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(fileName)
+    reader.SetExtractIndex([int(i) for i in index])
+    reader.SetExtractSize([int(s) for s in size])
+
+    return reader.Execute()
+
+def _initWorker(fileName, maskFileName):
+
+    global _fileName, _maskFileName
+    _fileName = fileName
+    _maskFileName = maskFileName
+
+def sampleBlock(region, fraction):
+    """Strided subsample of a block core.
+
+    """
+
+    coreIndex, coreSize, _, _ = region
+
+    array = sitk.GetArrayViewFromImage(readRegion(_fileName, coreIndex, coreSize)).reshape(-1)
+
+    return np.array(array[::max(int(round(1/fraction)), 1)])
+
+def kMeans1D(values, K, iterations=100):
+    """Sorted 1D k-means centers. Labels are found with np.searchsorted on the midpoints between the
+    sorted centers, so memory stays linear in the number of samples (no samples x K distances).
+
+    """
+
+    values = np.asarray(values, dtype=float)
+    centers = np.quantile(values, (np.arange(K)+0.5)/K)
+
+    for _ in range(iterations):
+        label = np.searchsorted((centers[1:]+centers[:-1])/2, values)
+        counts = np.bincount(label, minlength=K)
+        newCenters = np.sort(np.where(counts>0, np.bincount(label, values, K)/np.maximum(counts, 1), centers))
+        if np.allclose(newCenters, centers):
+            break
+        centers = newCenters
+
+    return np.sort(centers)
+
+def segmentBlock(region, centers, beta):
+    """Atropos segmentation of a block initialized with the shared class centers.
+
+    Parameters
+    ----------
+    region: tuple
+        Block region from blockRegions.
+    centers: array
+        Shared class centers.
+    beta: float
+        Sigmoid mask beta (used when there is no mask file).
+
+    Returns
+    -------
+    labels: array
+        Labels of the read region (uint8, 0 outside the mask).
+    classMeans: array
+        Mean intensity of each label on the block.
+
+    """
+
+    _, _, readIndex, readSize = region
+
+    block = readRegion(_fileName, readIndex, readSize)
+
+    if _maskFileName is None:
+        mask = applySigmoidMask(sitk.Cast(block, sitk.sitkInt16), beta)
+    else:
+        mask = readRegion(_maskFileName, readIndex, readSize)
+
+    array = sitk.GetArrayViewFromImage(block)
+    maskArray = sitk.GetArrayViewFromImage(mask)
+
+    K = len(centers)
+    labels = np.zeros(array.shape, dtype=np.uint8)
+    classMeans = np.array(centers, dtype=float)
+
+    if np.count_nonzero(maskArray)<=K:
+        return labels, classMeans
+
+    initialization = 'kmeans[{},{}]'.format(K, 'x'.join('{:g}'.format(c) for c in centers))
+
+    segmentationAnts = ants.atropos(a=arrayToAnts(array), m='[0.1, 1x1x1]', c='[50, 0.0001]',
+                                i=initialization, p='Socrates[1]', x=arrayToAnts(maskArray))
+
+    labels[...] = antsToArray(segmentationAnts['segmentation'])
+
+    counts = np.bincount(labels.reshape(-1), minlength=K+1)[1:K+1]
+    sums = np.bincount(labels.reshape(-1), array.reshape(-1).astype(float), K+1)[1:K+1]
+    classMeans = np.where(counts>0, sums/np.maximum(counts, 1), classMeans)
+
+    return labels, classMeans
+
+def reconcileLabels(labels, stitched, classMeans, centers):
+    """Label map (block label -> stitched label). Labels are matched by the overlap with already
+    stitched voxels or, without overlap, by the class mean intensities closest to the shared centers.
+
+    Parameters
+    ----------
+    labels: array
+        Block labels on the read region.
+    stitched: array
+        Stitched labels on the same region (0 where not written yet).
+    classMeans: array
+        Mean intensity of each block label.
+    centers: array
+        Shared class centers.
+
+    Returns
+    -------
+    labelMap: array
+        Stitched label for each block label (labelMap[0]=0).
+
+    """
+
+    K = len(centers)
+
+    written = (stitched>0)&(labels>0)
+    confusion = np.zeros((K, K))
+    np.add.at(confusion, (labels[written].astype(np.int64)-1, stitched[written].astype(np.int64)-1), 1)
+
+    if confusion.sum()>0:
+        rows, cols = linear_sum_assignment(-confusion)
+    else:
+        rows, cols = linear_sum_assignment(np.abs(np.asarray(classMeans)[:,None]-np.asarray(centers)[None,:]))
+
+    labelMap = np.zeros(K+1, dtype=np.uint8)
+    labelMap[rows+1] = cols+1
+
+    return labelMap
+
+def segmentTiled(fileName, outputName, blockSize=(128, 128, 128), overlap=16, K=3, fraction=0.01,
+        maskFileName=None, processes=None):
+    """Tiled atropos segmentation written to a memory-mapped .npy label volume.
+
+    Parameters
+    ----------
+    fileName: str
+        Input image file.
+    outputName: str
+        Output .npy file name (labels with numpy axis order).
+    blockSize: List
+        Core block size (sitk index order).
+    overlap: int
+        Overlap voxels on each side of the blocks.
+    K: int
+        Number of classes.
+    fraction: float
+        Fraction of voxels used to estimate the class centers and the sigmoid beta.
+    maskFileName: str
+        Mask file (default: sigmoid mask as in atroposSegmentation.py).
+    processes: int
+        Number of worker processes (default: number of CPUs).
+
+    Returns
+    -------
+    stitched: memmap
+        Stitched labels.
+
+    """
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(fileName)
+    reader.ReadImageInformation()
+    size = reader.GetSize()
+
+    regions = blockRegions(size, blockSize, overlap)
+
+    stitched = np.lib.format.open_memmap(outputName, mode='w+', dtype=np.uint8, shape=size[::-1])
+
+    with Pool(processes, initializer=_initWorker, initargs=(fileName, maskFileName)) as pool:
+
+        sample = np.concatenate(pool.starmap(sampleBlock, [(region, fraction) for region in regions]))
+
+        frequency, edges = intensityHistogram(sample.astype(np.int16))
+        beta = float(edges[frequency[1:-1].argmax()+1])
+
+        centers = kMeans1D(sample, K)
+
+        tasks = [(region, centers, beta) for region in regions]
+
+        for region, (labels, classMeans) in zip(regions, pool.imap(_segmentTask, tasks)):
+            coreIndex, coreSize, readIndex, readSize = region
+            read = tuple(slice(r, r+s) for r, s in zip(readIndex[::-1], readSize[::-1]))
+            core = tuple(slice(c-r, c-r+s) for c, r, s in zip(coreIndex[::-1], readIndex[::-1], coreSize[::-1]))
+
+            labelMap = reconcileLabels(labels, np.asarray(stitched[read]), classMeans, centers)
+
+            stitched[read][core] = labelMap[labels[core]]
+
+    stitched.flush()
+
+    return stitched
+
+def _segmentTask(task):
+
+    return segmentBlock(*task)
+
+def writeLabels(dataPath, referenceFileName, labels):
+    """Writes labels with the information (origin, spacing and direction) of a reference image file.
+
+    """
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(referenceFileName)
+    reader.ReadImageInformation()
+
+    labelImage = sitk.GetImageFromArray(np.asarray(labels))
+    labelImage.SetOrigin(reader.GetOrigin())
+    labelImage.SetSpacing(reader.GetSpacing())
+    labelImage.SetDirection(reader.GetDirection())
+
+    sitk.WriteImage(labelImage, dataPath)
+
+if __name__ == '__main__':
+
+    path = os.path.abspath("/home/solcia/Documents/phd/MRI data/rocks/3C/PSIF300/")
+    inputName = '/denoised_3C.nii.gz'
+    outputName = '/segmentation_MRIdata.nii.gz' #The forward slash is necessary to path+*Name work!
+
+    labels = segmentTiled(path+inputName, path+'/segmentation_MRIdata.npy')
+
+    writeLabels(path+outputName, path+inputName, labels)
@@ -0,0 +1,209 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Batch Time of Flight (TOF) brain extraction (tofBrainExtraction.py pipeline) for many subjects (e.g. IXI dataset). Subjects run on a process pool, T1 and TOF reorientation run concurrently and every stage is cached by a content hash of its inputs and parameters, so reruns skip completed stages. RUN THIS CODE WITH fslpython!
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from fsl.data.image import Image, addExt
+from fsl.utils.path import PathError
+from fsl.wrappers import robustfov, bet
+from fsl.wrappers.misc import fslreorient2std
+from tofBrainExtraction import convertMask2Tof
+
+def fileHash(fileName, blockSize=2**20):
+    """sha256 of an image file content.
+
+    Parameters
+    ----------
+    fileName: str
+        Image file name (with or without extension).
+    blockSize: int
+        Bytes read at once.
+
+    Returns
+    -------
+    digest: str
+        Hexadecimal sha256.
+
+    """
+
+    sha = hashlib.sha256()
+
+    with open(addExt(fileName), 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def imageExists(fileName):
+    """Condition of an image file existing (with any supported extension).
+
+    """
+
+    try:
+        addExt(fileName)
+    except PathError:
+        return False
+
+    return True
+
+def stageKey(stage, inputKeys, params):
+    """Cache key from stage name, input keys and stage parameters.
+
+    """
+
+    text = json.dumps([stage, inputKeys, params], sort_keys=True, default=str)
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def runStage(stage, function, inputKeys, outputs, cachePath, **params):
+    """Runs a stage unless its outputs exist with the same cache key.
+
+    Parameters
+    ----------
+    stage: str
+        Stage name (unique for each subject).
+    function: callable
+        Called with params to write outputs.
+    inputKeys: list
+        Content hashes (or upstream stage keys) of the stage inputs.
+    outputs: list
+        Output image names.
+    cachePath: str
+        Directory with the stage keys.
+    params: dict
+        Stage parameters (part of the key).
+
+    Returns
+    -------
+    key: str
+        Stage key, used as input key by the next stages.
+
+    """
+
+    key = stageKey(stage, inputKeys, params)
+    keyFile = os.path.join(cachePath, stage+'.sha256')
+
+    if os.path.exists(keyFile) and all(imageExists(output) for output in outputs):
+        with open(keyFile) as f:
+            if f.read()==key:
+                return key
+
+    function(**params)
+
+    with open(keyFile, 'w') as f:
+        f.write(key)
+
+    return key
+
+def transferMask(maskName, tofName, tofMaskName, tofBrainName, interpolation='nearest'):
+    """Mask on TOF voxel coordinates and masked TOF, computed in memory and saved once.
+
+    """
+
+    tof = Image(tofName)
+
+    tofMask = convertMask2Tof(tof, Image(maskName), interpolation)
+    tofMask.save(tofMaskName)
+
+    Image(np.asarray(tof.data)*tofMask.data, header=tof.header).save(tofBrainName)
+
+def processSubject(subject, inputPath, outputPath, interpolation='nearest'):
+    """Brain extraction pipeline for a single subject.
+
+    Parameters
+    ----------
+    subject: str
+        Subject id, e.g. IXI362-HH-2051 (inputs <id>-T1 and <id>-MRA).
+    inputPath: str
+        Directory with the input images.
+    outputPath: str
+        Directory for outputs and stage keys.
+    interpolation: str
+        Mask transfer interpolation ('nearest' or 'trilinear').
+
+    Returns
+    -------
+    subject: str
+        Subject id.
+    tofBrain: str
+        Output TOF brain image name.
+
+    """
+
+    inputT1 = os.path.join(inputPath, subject+'-T1')
+    inputTOF = os.path.join(inputPath, subject+'-MRA')
+    outputT1 = os.path.join(outputPath, subject+'-T1')
+    outputTOF = os.path.join(outputPath, subject+'-MRA')
+
+    cachePath = os.path.join(outputPath, '.cache', subject)
+    os.makedirs(cachePath, exist_ok=True)
+
+    with ThreadPoolExecutor(2) as executor:
+        futureT1 = executor.submit(runStage, 'reorientT1', fslreorient2std, [fileHash(inputT1)],
+                [outputT1+'_reorient'], cachePath, input=inputT1, output=outputT1+'_reorient')
+        futureTOF = executor.submit(runStage, 'reorientTOF', fslreorient2std, [fileHash(inputTOF)],
+                [outputTOF+'_reorient'], cachePath, input=inputTOF, output=outputTOF+'_reorient')
+        keyT1, keyTOF = futureT1.result(), futureTOF.result()
+
+    keyT1 = runStage('robustfov', robustfov, [keyT1], [outputT1+'_robust'], cachePath,
+            input=outputT1+'_reorient', output=outputT1+'_robust')
+
+    keyT1 = runStage('bet', bet, [keyT1], [outputT1+'_brain', outputT1+'_brain_mask'], cachePath,
+            input=outputT1+'_robust', output=outputT1+'_brain', R=True, m=True)
+
+    runStage('transferMask', transferMask, [keyT1, keyTOF], [outputTOF+'_brain_mask', outputTOF+'_brain'],
+            cachePath, maskName=outputT1+'_brain_mask', tofName=outputTOF+'_reorient',
+            tofMaskName=outputTOF+'_brain_mask', tofBrainName=outputTOF+'_brain', interpolation=interpolation)
+
+    return subject, outputTOF+'_brain'
+
+def runBatch(subjects, inputPath, outputPath, processes=None, interpolation='nearest'):
+    """Runs the brain extraction for a list of subjects on a process pool.
+
+    Parameters
+    ----------
+    subjects: list
+        Subject ids.
+    inputPath: str
+        Directory with the input images.
+    outputPath: str
+        Directory for outputs and stage keys.
+    processes: int
+        Number of worker processes (default: number of CPUs).
+    interpolation: str
+        Mask transfer interpolation ('nearest' or 'trilinear').
+
+    Returns
+    -------
+    outputs: dict
+        TOF brain image name for each subject.
+
+    """
+
+    os.makedirs(outputPath, exist_ok=True)
+
+    tasks = [(subject, inputPath, outputPath, interpolation) for subject in subjects]
+
+    with Pool(processes) as pool:
+        outputs = dict(pool.starmap(processSubject, tasks, chunksize=1))
+
+    return outputs
+
+if __name__=='__main__':
+
+    inputPath = '/home/solcia/Documents/phd/MRI/IXI'
+    outputPath = '/home/solcia/Documents/phd/MRI/IXI/brainExtraction'
+
+    subjects = sorted(name[:-len('-MRA.nii.gz')] for name in os.listdir(inputPath) if name.endswith('-MRA.nii.gz'))
+
+    outputs = runBatch(subjects, inputPath, outputPath)
+
+    print(len(outputs), 'subjects processed.')
@@ -108,7 +108,80 @@ def isInsideMaskSpace(transfMaskVoxCoord, maskShape):
                         (transfMaskVoxCoord[2]>=0 and transfMaskVoxCoord[2]<maskShape[2])
     return boolean
 
-def convertMask2Tof(tof, mask):
+def resampleMask(maskData, tofShape, tofVox2World, maskWorld2Vox, interpolation='nearest', chunkSize=16):
+    """Resamples mask data on the TOF voxel grid. The affines are composed once and the voxel grid is
+    transformed as arrays, chunkSize slices along k at a time. Voxels mapped outside the mask are zero.
+
+    Parameters
+    ----------
+    maskData: array
+        Mask voxel data.
+    tofShape: List
+        Shape from TOF image.
+    tofVox2World: array
+        Affine matrix from voxel to world coordinates based on the TOF image.
+    maskWorld2Vox: array
+        Affine matrix from world to voxel coordinates based on the mask image.
+    interpolation: str
+        'nearest' (same rounding as transformTof2MaskCoord) or 'trilinear'.
+    chunkSize: int
+        Number of k slices transformed at once.
+
+    Returns
+    -------
+    tofMaskData: array
+        Mask data on TOF voxel grid.
+
+    """
+
+    maskData = np.asarray(maskData)
+    maskShape = maskData.shape[:3]
+    affine = concat(maskWorld2Vox, tofVox2World)
+
+    tofMaskData = np.zeros(tofShape[:3])
+
+    i = np.arange(tofShape[0])[:,None,None]
+    j = np.arange(tofShape[1])[None,:,None]
+
+    for start in range(0, tofShape[2], chunkSize):
+        k = np.arange(start, min(start+chunkSize, tofShape[2]))[None,None,:]
+
+        coord = [affine[d,0]*i+affine[d,1]*j+affine[d,2]*k+affine[d,3] for d in range(3)]
+
+        if interpolation=='nearest':
+            index = [np.rint(c).astype(np.int64) for c in coord]
+            inside = np.ones(np.broadcast_shapes(*[c.shape for c in index]), dtype=bool)
+            for d in range(3):
+                inside &= (index[d]>=0)&(index[d]<maskShape[d])
+            index = [np.broadcast_to(c, inside.shape)[inside] for c in index]
+
+            chunk = np.zeros(inside.shape)
+            chunk[inside] = maskData[index[0], index[1], index[2]]
+
+        elif interpolation=='trilinear':
+            lower = [np.floor(c).astype(np.int64) for c in coord]
+            fraction = [c-l for c, l in zip(coord, lower)]
+
+            chunk = 0
+            for corner in np.ndindex(2, 2, 2):
+                weight = 1
+                inside = True
+                index = []
+                for d in range(3):
+                    n = lower[d]+corner[d]
+                    weight = weight*(fraction[d] if corner[d] else 1-fraction[d])
+                    inside = inside&(n>=0)&(n<maskShape[d])
+                    index.append(np.clip(n, 0, maskShape[d]-1))
+                chunk = chunk+np.where(inside, weight*maskData[index[0], index[1], index[2]], 0)
+
+        else:
+            raise ValueError('Unknown interpolation: '+interpolation)
+
+        tofMaskData[:,:,start:start+k.shape[2]] = chunk
+
+    return tofMaskData
+
+def convertMask2Tof(tof, mask, interpolation='nearest', chunkSize=16):
     """This function creates a new mask image on TOF voxel coordinates. Attention: this function 
     removes parts of the mask that are not contained insed the TOF Field of View (FOV).
 
@@ -118,6 +191,10 @@ def convertMask2Tof(tof, mask):
         Time of Flight MRI imported with fslpy tools.
     mask: fslImage
         Mask from a structural MRI brain extraction (output from fsl BET).
+    interpolation: str
+        'nearest' or 'trilinear'.
+    chunkSize: int
+        Number of k slices transformed at once.
 
     Returns
     -------
@@ -126,23 +203,11 @@ def convertMask2Tof(tof, mask):
 
     """
 
-    tofShape = tof.shape
-    maskShape = mask.shape
+    tofVox2World, maskWorld2Vox = getTofMaskAffines(tof, mask)
 
-    tofMask = createBlankImage(tof)
+    tofMaskData = resampleMask(mask.data, tof.shape, tofVox2World, maskWorld2Vox, interpolation, chunkSize)
 
-    tofVox2World, maskWorld2Vox = getTofMaskAffines(tof, mask)
-    
-    for i in range(tofShape[0]): #This can take a LONG time
-        for j in range(tofShape[1]): #Clearly three for's is not the best solution
-            for k in range(tofShape[2]): #feel free to contribute with a better solution!
-                
-                tofVoxCoord = [i, j, k]
-                transfMaskVoxCoord = transformTof2MaskCoord(tofVoxCoord, tofVox2World, maskWorld2Vox)
-
-                if(isInsideMaskSpace(transfMaskVoxCoord, maskShape)):
-                    tofMask.data[i,j,k] = mask.data[transfMaskVoxCoord[0],transfMaskVoxCoord[1],
-                                                    transfMaskVoxCoord[2]]
+    tofMask = Image(tofMaskData, header=tof.header)
 
     return tofMask
 
@@ -0,0 +1,275 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Vectorized ensemble kalman filter for Windkessel (RCR) parameter estimation. The whole ensemble is kept as a single (N, n_params) array, so forecast, covariances and analysis are array operations instead of per member loops. Same algorithm (and random number sequence) used in syntheticDataEnKF.py.
+
+"""
+import numpy as np
+from numpy import dot
+from numpy.random import multivariate_normal
+from scipy.linalg import cho_factor, cho_solve
+
+def pressureDynamics(p_i, dt, Rp, C, Rd, flowInput):
+    """Windkessel pressure forward step. Works with scalars or with arrays (one value per ensemble member).
+
+    Parameters
+    ----------
+    p_i: array
+        Pressure at previous time step.
+    dt: float
+        Time step.
+    Rp: array
+        Proximal resistance.
+    C: array
+        Compliance.
+    Rd: array
+        Distal resistance.
+    flowInput: list
+        Flow rate at previous and current time step.
+
+    Returns
+    -------
+    p: array
+        Pressure at current time step.
+
+    """
+
+    tau = Rd*C
+
+    flow_i = flowInput[1]
+    flow_im1 = flowInput[0]
+
+    p = p_i*(1-dt/tau)+Rp*(flow_i-flow_im1)+flow_i*(Rd+Rp)*dt/tau
+
+    return p
+
+def stochasticUpdate(thetas, theta, Y, z, E, R):
+    """Perturbed observations analysis step. The kalman gain is applied through a Cholesky solve of P_yy instead of an explicit inverse.
+
+    Parameters
+    ----------
+    thetas: array
+        Forecast ensemble (N, n_params).
+    theta: array
+        Ensemble mean used on the cross-covariance.
+    Y: array
+        Forecasted observations for each member (N, dim_z).
+    z: array
+        Observation (dim_z,).
+    E: array
+        Observation perturbations for each member (N, dim_z).
+    R: array
+        Observation noise covariance (dim_z, dim_z).
+
+    Returns
+    -------
+    thetas: array
+        Analysis ensemble (N, n_params).
+
+    """
+
+    N = thetas.shape[0]
+
+    A = Y-np.mean(Y, axis=0)
+
+    P_yy = dot(A.T, A)/(N-1) + R
+    P_xy = dot((thetas-theta).T, A)/(N-1)
+
+    D = z+E-Y
+
+    thetas = thetas + dot(cho_solve(cho_factor(P_yy), D.T).T, P_xy.T)
+
+    return thetas
+
+def transformUpdate(thetas, Y, z, R):
+    """Ensemble transform kalman filter (ETKF) analysis step from https://doi.org/10.1016/j.physd.2006.11.008. The analysis is computed on the N dimensional ensemble space, so the cost scales with the ensemble size rather than the observation dimension.
+
+    Parameters
+    ----------
+    thetas: array
+        Forecast ensemble (N, n_params).
+    Y: array
+        Forecasted observations for each member (N, dim_z).
+    z: array
+        Observation (dim_z,).
+    R: array
+        Observation noise covariance (dim_z, dim_z).
+
+    Returns
+    -------
+    thetas: array
+        Analysis ensemble (N, n_params).
+
+    """
+
+    N = thetas.shape[0]
+
+    theta = np.mean(thetas, axis=0)
+    X = thetas-theta
+    y_mean = np.mean(Y, axis=0)
+    A = Y-y_mean
+
+    C = cho_solve(cho_factor(R), A.T).T
+
+    w, V = np.linalg.eigh((N-1)*np.eye(N)+dot(C, A.T))
+
+    w_mean = dot(V, dot(V.T, dot(C, z-y_mean))/w)
+    W = dot(V*np.sqrt((N-1)/w), V.T)
+
+    thetas = theta + dot((W+w_mean[:,None]).T, X)
+
+    return thetas
+
+class EnsembleKalmanFilter:
+    """Ensemble kalman filter working on the whole ensemble at once. Each member is stored as log2 deviations (thetas) from the reference parameters x_ref = [Rp, C, Rd].
+
+    Parameters
+    ----------
+    x_ref: array
+        Reference parameters (initial guess) [Rp, C, Rd].
+    P: array
+        Initial covariance of the thetas ensemble.
+    Q: array
+        Process noise covariance added to thetas at each step.
+    N: int
+        Number of ensemble members.
+    pressure: float
+        Initial pressure for every ensemble member.
+    noiseLevel: float
+        Relative standard deviation of the observation perturbation (used when R is None).
+    R: array
+        Fixed observation noise covariance (dim_z, dim_z). If None, R is estimated from the
+        perturbations drawn with noiseLevel at each step.
+    method: str
+        Analysis step: 'stochastic' (perturbed observations) or 'etkf' (ensemble transform).
+
+    """
+
+    def __init__(self, x_ref, P, Q, N, pressure, noiseLevel=0.05, R=None, method='stochastic'):
+
+        self.x_ref = np.asarray(x_ref, dtype=float)
+        self.Q = Q
+        self.N = N
+        self.noiseLevel = noiseLevel
+        self.R = R
+        self.method = method
+
+        self.thetas = multivariate_normal(mean=np.zeros(self.x_ref.shape[0]), cov=P, size=N)
+        self.theta = np.mean(self.thetas, axis=0)
+        self.previousPressure = pressure*np.ones(N)
+        self.y = None
+
+    def predict(self, dt, flowInput):
+        """Forecast step: random walk on thetas and pressure dynamics for all members.
+
+        Parameters
+        ----------
+        dt: float
+            Time step.
+        flowInput: list
+            Flow rate at previous and current time step.
+
+        Returns
+        -------
+        y: array
+            Forecasted pressure for each ensemble member.
+
+        """
+
+        tau = multivariate_normal(mean=np.zeros(self.x_ref.shape[0]), cov=self.Q, size=self.N)
+        self.thetas += tau
+
+        parameters = self.x_ref*2**self.thetas
+
+        self.y = pressureDynamics(self.previousPressure, dt,
+                parameters[:,0], parameters[:,1], parameters[:,2], flowInput)
+        self.previousPressure = np.copy(self.y)
+
+        return self.y
+
+    def update(self, z):
+        """Analysis step with a single batched kalman gain application. Accepts scalar or vector observations.
+
+        Parameters
+        ----------
+        z: array
+            Observed pressure (float or array with dim_z values).
+
+        Returns
+        -------
+        theta: array
+            Ensemble mean of thetas after the update.
+
+        """
+
+        N = self.N
+        z = np.atleast_1d(z)
+        Y = self.y.reshape(N, -1)
+        dim_z = Y.shape[1]
+
+        if self.method=='etkf':
+            R = self.R if self.R is not None else np.diag((self.noiseLevel*z)**2)
+            # the transform mixes members, so member pressures are transformed along with thetas
+            n_params = self.thetas.shape[1]
+            augmented = transformUpdate(np.column_stack((self.thetas, self.previousPressure)), Y, z, R)
+            self.thetas = augmented[:,:n_params]
+            self.previousPressure = augmented[:,n_params]
+        else:
+            if self.R is None:
+                E = np.random.normal(0, self.noiseLevel*z, (N, dim_z))
+                R = dot(E.T, E)/(N-1)
+            else:
+                R = self.R
+                E = multivariate_normal(mean=np.zeros(dim_z), cov=R, size=N)
+            self.thetas = stochasticUpdate(self.thetas, self.theta, Y, z, E, R)
+
+        self.theta = np.mean(self.thetas, axis=0)
+
+        return self.theta
+
+    def run(self, dt, flow, p):
+        """Runs the filter over a whole flow and pressure waveform.
+
+        Parameters
+        ----------
+        dt: float
+            Time step.
+        flow: array
+            Flow rate array.
+        p: array
+            Observed pressure array.
+
+        Returns
+        -------
+        uxs: array
+            Ensemble mean of thetas for each time step.
+        uxs_std: array
+            Ensemble standard deviation of thetas for each time step.
+        zs: array
+            Ensemble mean of forecasted pressure for each time step.
+        zs_std: array
+            Ensemble standard deviation of forecasted pressure for each time step.
+
+        """
+
+        size_n = len(p)
+
+        uxs = np.zeros((size_n, self.x_ref.shape[0]))
+        uxs_std = np.zeros((size_n, self.x_ref.shape[0]))
+        zs = np.zeros(size_n)
+        zs_std = np.zeros(size_n)
+
+        for i in range(size_n):
+            if i==0:
+                flowInput = [flow[0], flow[0]]
+            else:
+                flowInput = [flow[i-1], flow[i]]
+
+            y = self.predict(dt, flowInput)
+            zs[i] = np.mean(y)
+            zs_std[i] = np.std(y)
+
+            uxs[i] = self.update(p[i])
+            uxs_std[i] = np.std(self.thetas, axis=0)
+
+        return uxs, uxs_std, zs, zs_std
@@ -0,0 +1,294 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Batch Windkessel (RCR) parameter identification for many synthetic patients. Each row of a parameter table (true parameters, initial guess and noise level) is estimated with the ensemble and/or unscented kalman filters on a process pool, and the convergence summaries are streamed to a parquet file.
+
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from multiprocessing import Pool
+from windkessel import generatePressure
+from ensembleKalmanFilter import EnsembleKalmanFilter
+from waveform import applyMultipleCycles
+from unscentedKalmanFilter import runWindkesselUKF
+
+_waveform = {}
+
+def _initWorker(t, flow):
+    """Process pool initializer that keeps the shared flow waveform on each worker.
+
+    """
+
+    _waveform['t'] = t
+    _waveform['flow'] = flow
+
+def syntheticPressure(t, flow, parameters):
+    """Noisy synthetic pressure for a given row of the parameter table.
+
+    Parameters
+    ----------
+    t: array
+        Waveform time array.
+    flow: array
+        Flow rate array.
+    parameters: dict
+        Row with Rp, C, Rd, p0, noise and seed keys.
+
+    Returns
+    -------
+    p: array
+        Synthetic pressure with gaussian noise.
+
+    """
+
+    np.random.seed(int(parameters['seed']))
+
+    p = generatePressure(t, flow, parameters['Rd'], parameters['Rp'],
+            parameters['C'], parameters['p0'])[0]
+    p += np.random.normal(0, parameters['noise'], len(flow))
+
+    return p
+
+def runEnKF(t, flow, p, parameters):
+    """Ensemble kalman filter estimation for a single synthetic patient.
+
+    Parameters
+    ----------
+    t: array
+        Waveform time array.
+    flow: array
+        Flow rate array.
+    p: array
+        Observed pressure array.
+    parameters: dict
+        Row with the initial guess (Rp_guess, C_guess, Rd_guess, pressure_guess) keys.
+
+    Returns
+    -------
+    estimates: array
+        [Rp, C, Rd] estimates for each time step.
+    zs: array
+        Estimated pressure for each time step.
+
+    """
+
+    dt = t[1]-t[0]
+    x_ini = np.array([parameters['Rp_guess'], parameters['C_guess'], parameters['Rd_guess']])
+
+    enkf = EnsembleKalmanFilter(x_ini, 0.25*np.eye(3), 0.0001*np.eye(3),
+            int(parameters.get('N', 100)), parameters['pressure_guess'])
+    uxs, uxs_std, zs, zs_std = enkf.run(dt, flow, p)
+
+    estimates = x_ini*2**uxs
+
+    return estimates, zs
+
+def runUKF(t, flow, p, parameters):
+    """Unscented kalman filter estimation for a single synthetic patient.
+
+    Parameters
+    ----------
+    t: array
+        Waveform time array.
+    flow: array
+        Flow rate array.
+    p: array
+        Observed pressure array.
+    parameters: dict
+        Row with the initial guess (Rp_guess, C_guess, Rd_guess, pressure_guess) keys.
+
+    Returns
+    -------
+    estimates: array
+        [Rp, C, Rd] estimates for each time step.
+    zs: array
+        Estimated pressure for each time step.
+
+    """
+
+    dt = t[1]-t[0]
+    x_ref = np.array([parameters['pressure_guess'], parameters['Rp_guess'],
+        parameters['C_guess'], parameters['Rd_guess']])
+
+    uxs, uxs_var = runWindkesselUKF(dt, flow, p[None,:], x_ref[None,:])
+    uxs = uxs[:,0]
+
+    estimates = x_ref[1:]*2**uxs[:,1:]
+    zs = x_ref[0]*2**uxs[:,0]
+
+    return estimates, zs
+
+ESTIMATORS = {'EnKF': runEnKF, 'UKF': runUKF}
+
+def convergenceSummary(estimates, zs, p, tol):
+    """Summary of a single estimation run.
+
+    Parameters
+    ----------
+    estimates: array
+        [Rp, C, Rd] estimates for each time step.
+    zs: array
+        Estimated pressure for each time step.
+    p: array
+        Observed pressure array.
+    tol: float
+        Relative tolerance to the final estimate used to define convergence.
+
+    Returns
+    -------
+    final: array
+        Final [Rp, C, Rd] estimate.
+    steps: int
+        Number of steps after which all estimates stay within tol of the final estimate.
+    rmse: float
+        Root mean square error between estimated and observed pressure.
+
+    """
+
+    final = estimates[-1]
+
+    relativeChange = np.abs(estimates-final)/np.abs(final)
+    notConverged = np.nonzero(np.any(relativeChange>tol, axis=1))[0]
+    steps = 0 if len(notConverged)==0 else int(notConverged[-1]+1)
+
+    rmse = float(np.sqrt(np.mean((zs-p)**2)))
+
+    return final, steps, rmse
+
+def runSingle(task):
+    """Process pool task: synthetic data generation, estimation and summary for one row and method.
+
+    """
+
+    method, run, parameters, tol = task
+    t = _waveform['t']
+    flow = _waveform['flow']
+
+    p = syntheticPressure(t, flow, parameters)
+    estimates, zs = ESTIMATORS[method](t, flow, p, parameters)
+    final, steps, rmse = convergenceSummary(estimates, zs, p, tol)
+
+    summary = {'run': run, 'method': method,
+            'Rp': float(parameters['Rp']), 'C': float(parameters['C']), 'Rd': float(parameters['Rd']),
+            'Rp_est': final[0], 'C_est': final[1], 'Rd_est': final[2],
+            'steps_to_convergence': steps, 'rmse': rmse}
+
+    return summary
+
+def runSweep(table, t, flow, outputFile, methods=('EnKF', 'UKF'), processes=None, tol=0.01, chunkSize=256):
+    """Runs the estimators for every row of a parameter table on a process pool and streams the summaries to a parquet file.
+
+    Parameters
+    ----------
+    table: DataFrame or str
+        Parameter table (or csv file name) with Rp, C, Rd, p0, Rp_guess, C_guess, Rd_guess,
+        pressure_guess and noise columns. Optional seed (default: row index) and N (ensemble size) columns.
+    t: array
+        Waveform time array shared by all runs.
+    flow: array
+        Flow rate array shared by all runs.
+    outputFile: str
+        Parquet file name for the convergence summaries.
+    methods: tuple
+        Estimators to run for each row ('EnKF' and/or 'UKF').
+    processes: int
+        Number of worker processes (default: number of CPUs).
+    tol: float
+        Relative tolerance used to define convergence.
+    chunkSize: int
+        Number of summaries written per parquet row group.
+
+    Returns
+    -------
+    n_runs: int
+        Number of written summaries.
+
+    """
+
+    if isinstance(table, str):
+        table = pd.read_csv(table)
+    if 'seed' not in table:
+        table = table.assign(seed=np.arange(len(table)))
+
+    tasks = ((method, run, parameters, tol)
+            for run, parameters in enumerate(table.to_dict('records'))
+            for method in methods)
+
+    writer = None
+    buffer = []
+    n_runs = 0
+
+    # the writer is closed even when a run fails, so the row groups already written keep a valid footer
+    try:
+        with Pool(processes, initializer=_initWorker, initargs=(t, flow)) as pool:
+            for summary in pool.imap_unordered(runSingle, tasks):
+                buffer.append(summary)
+                if len(buffer)>=chunkSize:
+                    writer = writeSummaries(writer, outputFile, buffer)
+                    n_runs += len(buffer)
+                    buffer = []
+    finally:
+        try:
+            if buffer:
+                writer = writeSummaries(writer, outputFile, buffer)
+                n_runs += len(buffer)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    return n_runs
+
+def writeSummaries(writer, outputFile, summaries):
+    """Appends a list of summaries as a new row group of the parquet file.
+
+    Parameters
+    ----------
+    writer: ParquetWriter
+        Open writer (None to create a new one).
+    outputFile: str
+        Parquet file name.
+    summaries: list
+        List of summary dictionaries.
+
+    Returns
+    -------
+    writer: ParquetWriter
+        Open writer for further row groups.
+
+    """
+
+    chunk = pa.Table.from_pylist(summaries)
+
+    if writer is None:
+        writer = pq.ParquetWriter(outputFile, chunk.schema)
+    writer.write_table(chunk)
+
+    return writer
+
+if __name__=='__main__':
+
+    mu = 0.35
+    sigma = 0.05
+    flow_amplitude = 10
+    flow_offset = 5
+    t = np.arange(0,0.8, 0.005)
+    flow = flow_offset+flow_amplitude*np.exp(-np.power(t-mu, 2)/(2*np.power(sigma,2)))
+
+    t_multiple, flow_multiple = applyMultipleCycles(t, flow, 10, 0.8)
+
+    #virtual patients around the windkessel parameters from the synthetic scripts
+    n_patients = 1000
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame({'Rp': 1600*2**rng.normal(0, 0.25, n_patients),
+                          'C': 2.5e-5*2**rng.normal(0, 0.25, n_patients),
+                          'Rd': 13000*2**rng.normal(0, 0.25, n_patients),
+                          'p0': 80000*np.ones(n_patients),
+                          'Rp_guess': 1000*np.ones(n_patients),
+                          'C_guess': 1e-5*np.ones(n_patients),
+                          'Rd_guess': 12000*np.ones(n_patients),
+                          'pressure_guess': 80000*np.ones(n_patients),
+                          'noise': 1600*np.ones(n_patients)})
+
+    runSweep(table, t_multiple, flow_multiple, 'sweepSummary.parquet')
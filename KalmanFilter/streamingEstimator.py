@@ -0,0 +1,206 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Streaming (online) Windkessel (RCR) parameter estimation. The ensemble and unscented kalman filters consume (flow, pressure) samples from any iterator and yield updated [Rp, C, Rd] estimates with bounded memory. A fixed size ring buffer can keep the recent history for plotting.
+
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+from itertools import cycle, islice
+from ensembleKalmanFilter import EnsembleKalmanFilter
+from unscentedKalmanFilter import UnscentedKalmanFilter, pressureDynamics, observation
+
+class RingBuffer:
+    """Fixed size history buffer. Rows are overwritten after size samples.
+
+    Parameters
+    ----------
+    size: int
+        Maximum number of stored rows.
+    width: int
+        Number of columns of each row.
+
+    """
+
+    def __init__(self, size, width):
+
+        self.data = np.zeros((size, width))
+        self.size = size
+        self.count = 0
+
+    def append(self, row):
+        """Stores a row, overwriting the oldest one when the buffer is full.
+
+        """
+
+        self.data[self.count%self.size] = row
+        self.count += 1
+
+    def values(self):
+        """Stored rows from the oldest to the newest.
+
+        Returns
+        -------
+        values: array
+            Array with shape (min(count, size), width).
+
+        """
+
+        if self.count<=self.size:
+            return self.data[:self.count].copy()
+
+        start = self.count%self.size
+
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+def streamEnKF(samples, dt, x_ref, P, Q, N, pressure, noiseLevel=0.05, history=None):
+    """Online ensemble kalman filter estimation.
+
+    Parameters
+    ----------
+    samples: iterator
+        Iterator of (flow, pressure) samples.
+    dt: float
+        Time step between samples.
+    x_ref: array
+        Reference parameters (initial guess) [Rp, C, Rd].
+    P: array
+        Initial covariance of the thetas ensemble.
+    Q: array
+        Process noise covariance.
+    N: int
+        Number of ensemble members.
+    pressure: float
+        Initial pressure for every ensemble member.
+    noiseLevel: float
+        Relative standard deviation of the observation perturbation.
+    history: RingBuffer
+        Optional buffer (width 5) receiving [Rp, C, Rd, estimated pressure, observed pressure] rows.
+
+    Yields
+    ------
+    estimate: array
+        Updated [Rp, C, Rd] estimate.
+
+    """
+
+    enkf = EnsembleKalmanFilter(x_ref, P, Q, N, pressure, noiseLevel)
+    flow_im1 = None
+
+    for flow_i, p_i in samples:
+        if flow_im1 is None:
+            flow_im1 = flow_i
+
+        y = enkf.predict(dt, [flow_im1, flow_i])
+        theta = enkf.update(p_i)
+        flow_im1 = flow_i
+
+        estimate = enkf.x_ref*2**theta
+        if history is not None:
+            history.append([*estimate, np.mean(y), p_i])
+
+        yield estimate
+
+def streamUKF(samples, dt, x_ref, alpha=1e-2, beta=2., kappa=0., R=0.01, Q=0.0001, history=None):
+    """Online unscented kalman filter estimation.
+
+    Parameters
+    ----------
+    samples: iterator
+        Iterator of (flow, pressure) samples.
+    dt: float
+        Time step between samples.
+    x_ref: array
+        Reference values [pressure, Rp, C, Rd].
+    alpha: float
+        Merwe scaled sigma points alpha.
+    beta: float
+        Merwe scaled sigma points beta.
+    kappa: float
+        Merwe scaled sigma points kappa.
+    R: float
+        Measurement noise variance.
+    Q: float
+        Process noise variance.
+    history: RingBuffer
+        Optional buffer (width 5) receiving [Rp, C, Rd, estimated pressure, observed pressure] rows.
+
+    Yields
+    ------
+    estimate: array
+        Updated [Rp, C, Rd] estimate.
+
+    """
+
+    x_ref = np.atleast_2d(x_ref)
+    dim_x = x_ref.shape[1]
+
+    ukf = UnscentedKalmanFilter(dim_x=dim_x, dim_z=dim_x, M=1, fx=pressureDynamics,
+            hx=observation, alpha=alpha, beta=beta, kappa=kappa)
+    ukf.R = R*np.eye(dim_x)
+    ukf.Q = Q*np.eye(dim_x)
+    flow_im1 = None
+
+    for flow_i, p_i in samples:
+        if flow_im1 is None:
+            flow_im1 = flow_i
+
+        z = ukf.x.copy()
+        z[:,0] = np.log(p_i/x_ref[:,0])/np.log(2)
+
+        ukf.predict(dt, flowInput=[np.array([flow_im1]), np.array([flow_i])], x_ref=x_ref)
+        ukf.update(z)
+        flow_im1 = flow_i
+
+        state = x_ref[0]*2**ukf.x[0]
+        estimate = state[1:]
+        if history is not None:
+            history.append([*estimate, state[0], p_i])
+
+        yield estimate
+
+if __name__=='__main__':
+
+    from windkessel import generatePressure
+
+    mu = 0.35
+    sigma = 0.05
+    flow_amplitude = 10
+    flow_offset = 5
+    t = np.arange(0,0.8, 0.005)
+    flow = flow_offset+flow_amplitude*np.exp(-np.power(t-mu, 2)/(2*np.power(sigma,2)))
+    dt = t[1]-t[0]
+
+    #windkessel parameters
+    Rp = 1600
+    C = 2.5e-5
+    Rd = 13000
+    p0 = 80000
+
+    #one periodic cycle emulating a continuous monitor
+    p = generatePressure(np.arange(0, 80, dt), np.tile(flow, 100), Rd, Rp, C, p0)[0,-len(flow):]
+    samples = ((q, p_i+np.random.normal(0, 1600)) for q, p_i in cycle(zip(flow, p)))
+
+    history = RingBuffer(4*len(flow), 5)
+    x_ref = np.array([80000, 1000, 1e-5, 12000])
+
+    for estimate in islice(streamUKF(samples, dt, x_ref, history=history), 20*len(flow)):
+        pass
+
+    print(estimate)
+
+    values = history.values()
+    fig, ax = plt.subplots(2,2)
+    ax[0,0].plot(values[:,4]*1e-3, color='k')
+    ax[0,0].plot(values[:,3]*1e-3, color='gray')
+    ax[0,0].set_ylabel('Pressure (mmHg)')
+    ax[0,1].plot(values[:,0], color='gray')
+    ax[0,1].axhline(Rp, linestyle='--', color='k')
+    ax[0,1].set_ylabel('$R_p$ (dyne-s/$cm^5$)')
+    ax[1,0].plot(values[:,1], color='gray')
+    ax[1,0].axhline(C, linestyle='--', color='k')
+    ax[1,0].set_ylabel('C ($cm^5$/dyne)')
+    ax[1,1].plot(values[:,2], color='gray')
+    ax[1,1].axhline(Rd, linestyle='--', color='k')
+    ax[1,1].set_ylabel('$R_d$ (dyne-s/$cm^5$)')
+    plt.show()
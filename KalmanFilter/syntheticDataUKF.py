@@ -5,41 +5,10 @@
 
 """
 import numpy as np
-import seaborn as sns
-from copy import deepcopy
 import matplotlib.pyplot as plt
-from numpy import dot, zeros, eye, outer
-from numpy.random import multivariate_normal
-from filterpy.kalman import MerweScaledSigmaPoints
-from filterpy.kalman import UnscentedKalmanFilter as UKF
-
-def applyMultipleCycles(T, V, n_cycle, period):
-    """Get the waveform and repeats it for a desired number of cycles (without fisiological variation).
-    
-    Parameters
-    ----------
-    T: array
-        Time points relative to time of mid-acceleration.
-    V: array
-        Normalized volumetric flow rate values feature points.
-    n_cycle: int
-        Desired number of cycles for tile operation.
-    period: float
-        Period of the waveform feature points.
-
-    Returns
-    -------
-    T_cycle: array
-        Time points repeated for a given period and number of cycles.
-    V_cycle:
-        Normalized volumetric flow rate feature points for a given period and number of cycles.
-
-    """
-
-    V_cycle = np.tile(V, n_cycle)
-    T_cycle = np.array([[n*period+t for t in T] for n in range(n_cycle)]).reshape(-1)
-
-    return T_cycle, V_cycle
+from windkessel import generatePressure
+from waveform import applyMultipleCycles
+from unscentedKalmanFilter import runWindkesselUKF
 
 def calculatePressure(t, flow, Rd, Rp, C, p0):
     """Calculate the pressure waveform at boundary from flow rate waveform, compliance, integration constant, and resistance (distal and proximal).
@@ -50,48 +19,24 @@ def calculatePressure(t, flow, Rd, Rp, C, p0):
         Waveform time array.
     flow: array
         Flow rate array (probably interpolated from waveform features measurements)
+    Rd: float
+        Distal resistance.
+    Rp: float
+        Proximal resistance.
+    C: float
+        Compliance.
+    p0: float
+        Integration constant (initial pressure).
 
     Returns
     -------
     p: array
 
     """
-    tau = Rd*C
-    Q0 = flow[0]
-    dt = t[1]-t[0]
-    p = []
-
-    for i in range(len(t)):
-        if i==0:
-            p.append(p0*(1-dt/tau)+Rp*flow[i]+flow[i]*(Rd+Rp)*dt/tau)
-        else:
-            p.append(p[i-1]*(1-dt/tau)+Rp*(flow[i]-flow[i-1])+flow[i]*(Rd+Rp)*dt/tau)
+    p = generatePressure(t, flow, Rd, Rp, C, p0)[0]
 
     return p
 
-def observation(sigma_point_minus):
-    H = np.array([1, 0, 0, 0])
-    observed_sigma = H*sigma_point_minus
-    return observed_sigma
-
-def pressureDynamics(sigmaPoint, dt, flowInput, x_ref):
-
-    p_i = x_ref[0]*2**sigmaPoint[0]
-    Rp = x_ref[1]*2**sigmaPoint[1]
-    C = x_ref[2]*2**sigmaPoint[2]
-    Rd =  x_ref[3]*2**sigmaPoint[3]
-    tau = Rd*C
-
-    flow_i = flowInput[1]
-    flow_im1 = flowInput[0]
-
-    p = p_i*(1-dt/tau)+Rp*(flow_i-flow_im1)+flow_i*(Rd+Rp)*dt/tau
-
-    sigmaPoint[0] = np.log(p/x_ref[0])/np.log(2)
-
-
-    return sigmaPoint
-
 if __name__=='__main__':
 
     mu = 0.35
@@ -122,35 +67,11 @@ if __name__=='__main__':
 
     x_ref = np.array([pressure, Rp_guess, C_guess, Rd_guess])
 
-    size_n = np.array(p).shape[0]
-
-    x = np.zeros(x_ref.shape[0])
-
-    sigmas = MerweScaledSigmaPoints(n=x.shape[0], alpha = 1e-2, beta = 2., kappa = 0.)
-    ukf = UKF(dim_x = x.shape[0], dim_z = 1, dt=dt, points = sigmas,
-            hx = observation, fx = pressureDynamics)
-    ukf.x = x
-    ukf.R = 0.01*np.eye(x.shape[0])
-    ukf.Q = 0.0001*np.eye(x.shape[0])
-    
-    uxs=[]
-    uxs_std = []
-    for i in range(size_n):
-        if i==0:
-            flowInput = [flow_multiple[0], flow_multiple[0]]
-        else:
-            flowInput = [flow_multiple[i-1], flow_multiple[i]]
-
-        z = [np.log(p[i]/x_ref[0])/np.log(2), ukf.x[1], ukf.x[2], ukf.x[3]]
-
-        ukf.predict(**{'flowInput':flowInput, 'x_ref':x_ref})
-        ukf.update(z)
-        uxs.append(ukf.x.copy())
-        uxs_std.append([ukf.P[0,0], ukf.P[1,1], ukf.P[2,2], ukf.P[3,3]])
-
+    uxs, uxs_std = runWindkesselUKF(dt, flow_multiple, p[None,:], x_ref[None,:],
+            alpha = 1e-2, beta = 2., kappa = 0., R = 0.01, Q = 0.0001)
+    uxs = uxs[:,0]
+    uxs_std = uxs_std[:,0]
 
-    uxs=np.array(uxs)
-    uxs_std=np.array(uxs_std)
     fig, ax = plt.subplots(2,2)
     ax[0,0].plot(t_multiple,p*1e-3, color='k')
     ax[0,0].plot(t_multiple,x_ref[0]*2**(uxs[:,0])*1e-3, color='gray')
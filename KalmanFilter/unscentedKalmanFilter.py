@@ -0,0 +1,296 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Batched unscented kalman filter for Windkessel (RCR) parameter estimation. All 2n+1 sigma points of M independent filters are propagated as a single (M, 2n+1, n) array, so each time step costs a few numpy calls. Same algorithm and Merwe scaled sigma points from https://filterpy.readthedocs.io/en/latest/.
+
+"""
+import numpy as np
+
+def merweScaledWeights(n, alpha, beta, kappa):
+    """Weights of the Van der Merwe scaled sigma points (same values as filterpy MerweScaledSigmaPoints).
+
+    Parameters
+    ----------
+    n: int
+        State dimension.
+    alpha: float
+        Spread of the sigma points around the mean.
+    beta: float
+        Prior knowledge of the distribution (2 is optimal for gaussian).
+    kappa: float
+        Secondary scaling parameter.
+
+    Returns
+    -------
+    Wm: array
+        Weights for the mean.
+    Wc: array
+        Weights for the covariance.
+
+    """
+
+    lambda_ = alpha**2*(n+kappa)-n
+    c = .5/(n+lambda_)
+
+    Wc = np.full(2*n+1, c)
+    Wm = np.full(2*n+1, c)
+    Wc[0] = lambda_/(n+lambda_)+(1-alpha**2+beta)
+    Wm[0] = lambda_/(n+lambda_)
+
+    return Wm, Wc
+
+def unscentedTransform(sigmas, Wm, Wc, noise_cov):
+    """Batched unscented transform.
+
+    Parameters
+    ----------
+    sigmas: array
+        Sigma points with shape (M, 2n+1, dim).
+    Wm: array
+        Weights for the mean.
+    Wc: array
+        Weights for the covariance.
+    noise_cov: array
+        Noise covariance (dim, dim) or (M, dim, dim) added to the transformed covariance.
+
+    Returns
+    -------
+    x: array
+        Mean for each filter (M, dim).
+    P: array
+        Covariance for each filter (M, dim, dim).
+
+    """
+
+    x = np.einsum('k,mki->mi', Wm, sigmas)
+    y = sigmas-x[:,None,:]
+    P = np.einsum('k,mki,mkj->mij', Wc, y, y)+noise_cov
+
+    return x, P
+
+def pressureDynamics(sigmaPoints, dt, flowInput, x_ref):
+    """Windkessel forward step for sigma points stored as log2 deviations [pressure, Rp, C, Rd] from x_ref. Works with a single sigma point (4,) or with a batch (M, 2n+1, 4).
+
+    Parameters
+    ----------
+    sigmaPoints: array
+        Sigma points.
+    dt: float
+        Time step.
+    flowInput: list
+        Flow rate at previous and current time step (floats or arrays with one value per filter).
+    x_ref: array
+        Reference values (4,) or (M, 4).
+
+    Returns
+    -------
+    sigmaPoints: array
+        Sigma points with propagated pressure.
+
+    """
+
+    sigmaPoints = np.array(sigmaPoints, dtype=float)
+
+    x_ref = np.asarray(x_ref)
+    flow_i = np.asarray(flowInput[1])
+    flow_im1 = np.asarray(flowInput[0])
+    if x_ref.ndim>1:
+        x_ref = x_ref[:,None,:]
+    if flow_i.ndim>0:
+        flow_i = flow_i[:,None]
+        flow_im1 = flow_im1[:,None]
+
+    p_i = x_ref[...,0]*2**sigmaPoints[...,0]
+    Rp = x_ref[...,1]*2**sigmaPoints[...,1]
+    C = x_ref[...,2]*2**sigmaPoints[...,2]
+    Rd = x_ref[...,3]*2**sigmaPoints[...,3]
+    tau = Rd*C
+
+    p = p_i*(1-dt/tau)+Rp*(flow_i-flow_im1)+flow_i*(Rd+Rp)*dt/tau
+
+    sigmaPoints[...,0] = np.log(p/x_ref[...,0])/np.log(2)
+
+    return sigmaPoints
+
+def observation(sigmaPoints):
+    """Pressure observation of the sigma points.
+
+    """
+
+    H = np.array([1, 0, 0, 0])
+    observed_sigma = H*sigmaPoints
+
+    return observed_sigma
+
+class UnscentedKalmanFilter:
+    """Unscented kalman filter running M independent filters at once.
+
+    Parameters
+    ----------
+    dim_x: int
+        State dimension.
+    dim_z: int
+        Measurement dimension.
+    M: int
+        Number of independent filters.
+    fx: function
+        State transition fx(sigmas, dt, **fx_args) working on (M, 2n+1, dim_x) arrays.
+    hx: function
+        Measurement function hx(sigmas) working on (M, 2n+1, dim_x) arrays.
+    alpha: float
+        Merwe scaled sigma points alpha.
+    beta: float
+        Merwe scaled sigma points beta.
+    kappa: float
+        Merwe scaled sigma points kappa.
+
+    Attributes
+    ----------
+    x: array
+        State of each filter (M, dim_x).
+    P: array
+        Covariance of each filter (M, dim_x, dim_x).
+    Q: array
+        Process noise (dim_x, dim_x) or (M, dim_x, dim_x).
+    R: array
+        Measurement noise (dim_z, dim_z) or (M, dim_z, dim_z).
+
+    """
+
+    def __init__(self, dim_x, dim_z, M, fx, hx, alpha, beta, kappa):
+
+        self.dim_x = dim_x
+        self.dim_z = dim_z
+        self.M = M
+        self.fx = fx
+        self.hx = hx
+
+        self.lambda_ = alpha**2*(dim_x+kappa)-dim_x
+        self.Wm, self.Wc = merweScaledWeights(dim_x, alpha, beta, kappa)
+
+        self.x = np.zeros((M, dim_x))
+        self.P = np.tile(np.eye(dim_x), (M, 1, 1))
+        self.Q = np.eye(dim_x)
+        self.R = np.eye(dim_z)
+        self.sigmas_f = None
+
+    def sigmaPoints(self):
+        """Merwe scaled sigma points of every filter.
+
+        Returns
+        -------
+        sigmas: array
+            Sigma points with shape (M, 2n+1, dim_x).
+
+        """
+
+        n = self.dim_x
+
+        L = np.linalg.cholesky((self.lambda_+n)*self.P)
+        U = np.swapaxes(L, -1, -2)
+
+        sigmas = np.empty((self.M, 2*n+1, n))
+        sigmas[:,0] = self.x
+        sigmas[:,1:n+1] = self.x[:,None,:]+U
+        sigmas[:,n+1:] = self.x[:,None,:]-U
+
+        return sigmas
+
+    def predict(self, dt, **fx_args):
+        """Predict step for all filters.
+
+        Parameters
+        ----------
+        dt: float
+            Time step.
+        **fx_args: dict
+            Keyword arguments passed to fx.
+
+        """
+
+        self.sigmas_f = self.fx(self.sigmaPoints(), dt, **fx_args)
+        self.x, self.P = unscentedTransform(self.sigmas_f, self.Wm, self.Wc, self.Q)
+
+    def update(self, z):
+        """Update step for all filters.
+
+        Parameters
+        ----------
+        z: array
+            Measurements with shape (M, dim_z).
+
+        """
+
+        sigmas_h = self.hx(self.sigmas_f)
+        zp, S = unscentedTransform(sigmas_h, self.Wm, self.Wc, self.R)
+
+        Pxz = np.einsum('k,mki,mkj->mij', self.Wc,
+                self.sigmas_f-self.x[:,None,:], sigmas_h-zp[:,None,:])
+
+        K = np.swapaxes(np.linalg.solve(S, np.swapaxes(Pxz, -1, -2)), -1, -2)
+
+        self.x = self.x+np.einsum('mij,mj->mi', K, z-zp)
+        self.P = self.P-K@S@np.swapaxes(K, -1, -2)
+
+def runWindkesselUKF(dt, flow, p, x_ref, alpha=1e-2, beta=2., kappa=0., R=0.01, Q=0.0001):
+    """Runs M Windkessel unscented kalman filters (one per pressure waveform) over the whole waveform.
+
+    Parameters
+    ----------
+    dt: float
+        Time step.
+    flow: array
+        Flow rate array (n_samples,) shared by all filters or (M, n_samples).
+    p: array
+        Observed pressure array (M, n_samples).
+    x_ref: array
+        Reference values [pressure, Rp, C, Rd] for each filter (M, 4).
+    alpha: float
+        Merwe scaled sigma points alpha.
+    beta: float
+        Merwe scaled sigma points beta.
+    kappa: float
+        Merwe scaled sigma points kappa.
+    R: float
+        Measurement noise variance.
+    Q: float
+        Process noise variance.
+
+    Returns
+    -------
+    uxs: array
+        States (log2 deviations from x_ref) with shape (n_samples, M, 4).
+    uxs_var: array
+        State variances with shape (n_samples, M, 4).
+
+    """
+
+    p = np.atleast_2d(p)
+    x_ref = np.atleast_2d(x_ref)
+    flow = np.broadcast_to(flow, p.shape)
+    M, size_n = p.shape
+    dim_x = x_ref.shape[1]
+
+    ukf = UnscentedKalmanFilter(dim_x=dim_x, dim_z=dim_x, M=M, fx=pressureDynamics,
+            hx=observation, alpha=alpha, beta=beta, kappa=kappa)
+    ukf.R = R*np.eye(dim_x)
+    ukf.Q = Q*np.eye(dim_x)
+
+    uxs = np.zeros((size_n, M, dim_x))
+    uxs_var = np.zeros((size_n, M, dim_x))
+
+    for i in range(size_n):
+        if i==0:
+            flowInput = [flow[:,0], flow[:,0]]
+        else:
+            flowInput = [flow[:,i-1], flow[:,i]]
+
+        z = ukf.x.copy()
+        z[:,0] = np.log(p[:,i]/x_ref[:,0])/np.log(2)
+
+        ukf.predict(dt, flowInput=flowInput, x_ref=x_ref)
+        ukf.update(z)
+        uxs[i] = ukf.x
+        uxs_var[i] = np.diagonal(ukf.P, axis1=1, axis2=2)
+
+    return uxs, uxs_var
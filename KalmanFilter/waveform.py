@@ -0,0 +1,173 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Periodic flow rate waveform shared by the kalman scripts. The waveform feature points of a single period are kept and every cycle is computed on demand, so multi-cycle runs do not need to allocate tiled arrays.
+
+"""
+import numpy as np
+
+class PeriodicWaveform:
+    """Lazy periodic waveform. Behaves as a (read only) array of flow rate values and computes the
+    time points and values of any cycle from the single period feature points.
+
+    Parameters
+    ----------
+    T: array
+        Time points of one period.
+    V: array
+        Flow rate values of one period.
+    period: float
+        Period of the waveform.
+    n_cycle: int
+        Number of cycles (None for an unbounded waveform).
+
+    """
+
+    def __init__(self, T, V, period, n_cycle=None):
+
+        self.T = np.asarray(T, dtype=float)
+        self.V = np.asarray(V)
+        self.period = period
+        self.n_cycle = n_cycle
+        self.n_samples = self.T.shape[0]
+
+    def __len__(self):
+
+        if self.n_cycle is None:
+            raise TypeError('Unbounded waveform has no length.')
+
+        return self.n_cycle*self.n_samples
+
+    def _indices(self, key):
+        """Sample indices from an integer, slice or array key.
+
+        """
+
+        if isinstance(key, slice):
+            if self.n_cycle is None:
+                if key.stop is None or (key.start or 0)<0 or key.stop<0:
+                    raise IndexError('Unbounded waveform slices need non negative start and stop.')
+                return np.arange(key.start or 0, key.stop, key.step or 1)
+            return np.arange(*key.indices(len(self)))
+
+        index = np.asarray(key)
+        if self.n_cycle is not None:
+            if np.any((index>=len(self))|(index<-len(self))):
+                raise IndexError('Waveform index out of range.')
+            index = np.where(index<0, index+len(self), index)
+        elif np.any(index<0):
+            raise IndexError('Unbounded waveform does not support negative indices.')
+
+        return index
+
+    def __getitem__(self, key):
+        """Flow rate value(s) for a sample index, slice or index array.
+
+        """
+
+        return self.V[self._indices(key)%self.n_samples]
+
+    def __iter__(self):
+
+        i = 0
+        while self.n_cycle is None or i<len(self):
+            yield self.V[i%self.n_samples]
+            i += 1
+
+    def time(self, key):
+        """Time point(s) for a sample index, slice or index array.
+
+        """
+
+        index = self._indices(key)
+
+        return (index//self.n_samples)*self.period+self.T[index%self.n_samples]
+
+    def at(self, t):
+        """Flow rate at time(s) t, linearly interpolated between feature points.
+
+        Parameters
+        ----------
+        t: array
+            Time points.
+
+        Returns
+        -------
+        V: array
+            Interpolated flow rate values.
+
+        """
+
+        return np.interp(t, self.T, self.V, period=self.period)
+
+    def sampleIndex(self, t):
+        """Index of the first sample at or after time(s) t.
+
+        """
+
+        t = np.asarray(t, dtype=float)
+        cycle = np.floor((t-self.T[0])/self.period).astype(int)
+        index = np.searchsorted(self.T, t-cycle*self.period)
+
+        return cycle*self.n_samples+index
+
+    def timeSlice(self, t_start, t_stop):
+        """Samples with time in [t_start, t_stop).
+
+        Returns
+        -------
+        t: array
+            Time points.
+        V: array
+            Flow rate values.
+
+        """
+
+        index = slice(int(self.sampleIndex(t_start)), int(self.sampleIndex(t_stop)))
+
+        return self.time(index), self[index]
+
+    def materialize(self):
+        """Dense time and flow rate arrays for all cycles.
+
+        Returns
+        -------
+        T_cycle: array
+            Time points repeated for the number of cycles.
+        V_cycle: array
+            Flow rate values repeated for the number of cycles.
+
+        """
+
+        if self.n_cycle is None:
+            raise TypeError('Unbounded waveform can not be materialized.')
+
+        T_cycle = np.add.outer(self.period*np.arange(self.n_cycle), self.T).reshape(-1)
+        V_cycle = np.tile(self.V, self.n_cycle)
+
+        return T_cycle, V_cycle
+
+def applyMultipleCycles(T, V, n_cycle, period):
+    """Get the waveform and repeats it for a desired number of cycles (without fisiological variation).
+
+    Parameters
+    ----------
+    T: array
+        Time points relative to time of mid-acceleration.
+    V: array
+        Normalized volumetric flow rate values feature points.
+    n_cycle: int
+        Desired number of cycles for tile operation.
+    period: float
+        Period of the waveform feature points.
+
+    Returns
+    -------
+    T_cycle: array
+        Time points repeated for a given period and number of cycles.
+    V_cycle:
+        Normalized volumetric flow rate feature points for a given period and number of cycles.
+
+    """
+
+    return PeriodicWaveform(T, V, period, n_cycle).materialize()
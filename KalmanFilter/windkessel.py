@@ -0,0 +1,85 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Vectorized synthetic pressure generation for the three element Windkessel (RCR) model. The discrete model used in the kalman scripts is a linear recurrence p[i] = a*p[i-1] + b[i], evaluated here for many parameter sets at once. Synthetic flow and pressure from https://doi.org/10.1002/cnm.2692.
+
+"""
+import numpy as np
+from scipy.signal import lfilter
+
+def linearRecurrence(a, b):
+    """Evaluates p[:,i] = a*p[:,i-1] + b[:,i] (with p[:,-1] = 0) for every row at once. Uses scipy lfilter when all rows share the same coefficient and a log-step (Hillis-Steele) scan otherwise.
+
+    Parameters
+    ----------
+    a: array
+        Recurrence coefficient for each row, shape (n_params,).
+    b: array
+        Forcing terms, shape (n_params, n_samples).
+
+    Returns
+    -------
+    p: array
+        Recurrence solution, shape (n_params, n_samples).
+
+    """
+
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+
+    if np.all(a==a[0]):
+        return lfilter([1.0], [1.0, -a[0]], b, axis=-1)
+
+    p = b.copy()
+    a_shift = a[:,None].copy()
+    shift = 1
+    n_samples = p.shape[1]
+
+    while shift < n_samples:
+        p[:,shift:] += a_shift*p[:,:-shift].copy()
+        a_shift *= a_shift
+        shift *= 2
+
+    return p
+
+def generatePressure(t, flow, Rd, Rp, C, p0):
+    """Calculate the pressure waveforms at boundary for several Windkessel parameter sets in one call. Same discretization used in calculatePressure from the kalman scripts.
+
+    Parameters
+    ----------
+    t: array
+        Waveform time array.
+    flow: array
+        Flow rate array, shape (n_samples,) shared by all parameter sets or (n_params, n_samples).
+    Rd: array
+        Distal resistance for each parameter set.
+    Rp: array
+        Proximal resistance for each parameter set.
+    C: array
+        Compliance for each parameter set.
+    p0: array
+        Integration constant (initial pressure) for each parameter set.
+
+    Returns
+    -------
+    p: array
+        Pressure matrix with shape (n_params, n_samples).
+
+    """
+
+    Rd, Rp, C, p0 = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                        for x in (Rd, Rp, C, p0)])
+    flow = np.atleast_2d(np.asarray(flow, dtype=float))
+
+    dt = t[1]-t[0]
+    tau = Rd*C
+    a = 1-dt/tau
+
+    dflow = np.diff(flow, axis=-1, prepend=0)
+
+    b = Rp[:,None]*dflow+flow*((Rd+Rp)*dt/tau)[:,None]
+    b[:,0] += p0*a
+
+    p = linearRecurrence(a, b)
+
+    return p
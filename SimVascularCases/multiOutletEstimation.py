@@ -0,0 +1,385 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Joint estimation of all outlet RCR parameters of a 0D vessel network (SimVascular ZeroDSolver input file) from multi-outlet pressure and flow observations. The forward 0D model is evaluated for the whole ensemble at once (one batched linear solve per time step) instead of running one ZeroDSolver simulation per ensemble member.
+
+The network is modelled with R-L-C vessels (resistance and stenosis in series with the inductance, compliance at the vessel outlet), pressure continuity and mass conservation at junctions, prescribed inflow and RCR outlets, integrated with backward Euler.
+"""
+
+import os
+import sys
+import json
+import numpy as np
+import matplotlib.pyplot as plt
+from numpy.random import multivariate_normal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'KalmanFilter'))
+
+from ensembleKalmanFilter import stochasticUpdate, transformUpdate
+
+def readZeroDModel(file_path):
+    """Reads vessels, junctions and boundary conditions from a ZeroDSolver input file.
+
+    Parameters
+    ----------
+    file_path: str
+        ZeroDSolver input file (e.g. CarotidArtery_0D/solver_0d.in).
+
+    Returns
+    -------
+    model: dict
+        Vessel arrays (R, C, L, S, parent), inlet vessel, outlet vessels and names,
+        RCR parameters [Rp, C, Rd] and Pd of each outlet, inflow waveform and time step.
+
+    """
+
+    with open(file_path, 'r') as infile:
+        parameters = json.load(infile)
+
+    vessels = sorted(parameters['vessels'], key=lambda vessel: vessel['vessel_id'])
+    n_vessels = len(vessels)
+    bcs = {bc['bc_name']: bc for bc in parameters['boundary_conditions']}
+
+    values = [vessel['zero_d_element_values'] for vessel in vessels]
+    R = np.array([value.get('R_poiseuille', 0.0) for value in values])
+    C = np.array([value.get('C', 0.0) for value in values])
+    L = np.array([value.get('L', 0.0) for value in values])
+    S = np.array([value.get('stenosis_coefficient', 0.0) for value in values])
+
+    parent = -np.ones(n_vessels, dtype=int)
+    for junction in parameters['junctions']:
+        if len(junction['inlet_vessels'])!=1:
+            raise ValueError('Only junctions with a single inlet vessel are supported: '+junction['junction_name'])
+        parent[junction['outlet_vessels']] = junction['inlet_vessels'][0]
+
+    inlet = None
+    outlets = []
+    rcr = []
+    Pd = []
+    for vessel in vessels:
+        vessel_bcs = vessel.get('boundary_conditions', {})
+        if 'inlet' in vessel_bcs:
+            inlet = vessel['vessel_id']
+            inflow = bcs[vessel_bcs['inlet']]['bc_values']
+        if 'outlet' in vessel_bcs:
+            bc_values = bcs[vessel_bcs['outlet']]['bc_values']
+            outlets.append(vessel['vessel_id'])
+            rcr.append([bc_values['Rp'], bc_values['C'], bc_values['Rd']])
+            Pd.append(bc_values.get('Pd', 0.0))
+
+    simulation = parameters['simulation_parameters']
+    t_inflow = np.array(inflow['t'])
+    period = t_inflow[-1]-t_inflow[0]
+    dt = period/(simulation['number_of_time_pts_per_cardiac_cycle']-1)
+    n_steps = simulation['number_of_cardiac_cycles']*(simulation['number_of_time_pts_per_cardiac_cycle']-1)+1
+
+    model = {'R': R, 'C': C, 'L': L, 'S': S, 'parent': parent, 'inlet': inlet,
+             'outlets': np.array(outlets), 'names': ['BC'+str(vessel_id)+'_outlet' for vessel_id in outlets],
+             'rcr': np.array(rcr), 'Pd': np.array(Pd),
+             't_inflow': t_inflow, 'Q_inflow': np.array(inflow['Q']),
+             'period': period, 'dt': dt, 'n_steps': n_steps}
+
+    return model
+
+class ZeroDEnsembleModel:
+    """Batched 0D network model. The state of each ensemble member is [Q of each vessel, P at the
+    outlet of each vessel, P on the capacitor of each RCR outlet].
+
+    Parameters
+    ----------
+    model: dict
+        Output from readZeroDModel.
+
+    """
+
+    def __init__(self, model):
+
+        self.model = model
+        self.n_vessels = len(model['R'])
+        self.n_outlets = len(model['outlets'])
+        self.n_state = 2*self.n_vessels+self.n_outlets
+
+        n_v = self.n_vessels
+        inlet = model['inlet']
+
+        E = np.concatenate((model['L'], model['C'], np.zeros(self.n_outlets)))
+        E[inlet] = 0
+
+        A = np.zeros((self.n_state, self.n_state))
+        A[inlet, inlet] = -1
+        for v, parent in enumerate(model['parent']):
+            A[n_v+v, v] = 1
+            if v==inlet:
+                continue
+            A[v, n_v+parent] = 1
+            A[v, n_v+v] = -1
+            A[n_v+parent, v] = -1
+
+        self.E = E
+        self.A = A
+
+        self.momentumRows = np.array([v for v in range(n_v) if v!=inlet])
+        self.outletRows = n_v+model['outlets']
+        self.capacitorRows = 2*n_v+np.arange(self.n_outlets)
+
+    def inflow(self, t):
+        """Periodic inflow at time t.
+
+        """
+
+        model = self.model
+
+        return np.interp(t%model['period'], model['t_inflow'], model['Q_inflow'])
+
+    def step(self, x, rcr, t, dt):
+        """Backward Euler step for all ensemble members. Stenosis resistance is linearized with the
+        flow at the previous step.
+
+        Parameters
+        ----------
+        x: array
+            States (N, n_state).
+        rcr: array
+            RCR parameters [Rp, C, Rd] of each outlet for each member (N, n_outlets, 3).
+        t: float
+            Time at the end of the step.
+        dt: float
+            Time step.
+
+        Returns
+        -------
+        x: array
+            States at time t (N, n_state).
+
+        """
+
+        N = x.shape[0]
+        model = self.model
+        Rp = rcr[:,:,0]
+        Cr = rcr[:,:,1]
+        Rd = rcr[:,:,2]
+
+        A = np.repeat(self.A[None], N, axis=0)
+        rows = self.momentumRows
+        A[:, rows, rows] = -(model['R'][rows]+model['S'][rows]*np.abs(x[:, rows]))
+        A[:, self.outletRows, self.outletRows] = -1/Rp
+        A[:, self.outletRows, self.capacitorRows] = 1/Rp
+        A[:, self.capacitorRows, self.outletRows] = 1/Rp
+        A[:, self.capacitorRows, self.capacitorRows] = -1/Rp-1/Rd
+
+        E = np.repeat(self.E[None], N, axis=0)
+        E[:, self.capacitorRows] = Cr
+
+        b = np.zeros((N, self.n_state))
+        b[:, model['inlet']] = self.inflow(t)
+        b[:, self.capacitorRows] = model['Pd']/Rd
+
+        M = -dt*A
+        M[:, np.arange(self.n_state), np.arange(self.n_state)] += E
+
+        x = np.linalg.solve(M, (E*x+dt*b)[:,:,None])[:,:,0]
+
+        return x
+
+    def observe(self, x, rcr):
+        """Outlet pressures and flows.
+
+        Parameters
+        ----------
+        x: array
+            States (N, n_state).
+        rcr: array
+            RCR parameters (N, n_outlets, 3).
+
+        Returns
+        -------
+        y: array
+            [P of each outlet, Q of each outlet] for each member (N, 2*n_outlets).
+
+        """
+
+        P = x[:, self.outletRows]
+        Q = (P-x[:, self.capacitorRows])/rcr[:,:,0]
+
+        return np.concatenate((P, Q), axis=1)
+
+    def simulate(self, rcr):
+        """Forward simulation of several RCR parameter sets at once.
+
+        Parameters
+        ----------
+        rcr: array
+            RCR parameters (N, n_outlets, 3).
+
+        Returns
+        -------
+        t: array
+            Time array.
+        y: array
+            Outlet pressures and flows (n_steps, N, 2*n_outlets).
+
+        """
+
+        model = self.model
+        dt = model['dt']
+        t = np.arange(model['n_steps'])*dt
+
+        x = np.zeros((rcr.shape[0], self.n_state))
+        y = np.zeros((len(t), rcr.shape[0], 2*self.n_outlets))
+        for i in range(1, len(t)):
+            x = self.step(x, rcr, t[i], dt)
+            y[i] = self.observe(x, rcr)
+
+        return t, y
+
+class MultiOutletEnKF:
+    """Ensemble kalman filter for joint estimation of every outlet RCR parameter. Parameters are
+    stored as log2 deviations (thetas) from the reference values and the 0D states are estimated
+    jointly with them.
+
+    Parameters
+    ----------
+    zeroDModel: ZeroDEnsembleModel
+        Batched 0D model.
+    rcr_ref: array
+        Reference (initial guess) RCR parameters (n_outlets, 3).
+    P: float
+        Initial variance of thetas.
+    Q: float
+        Process noise variance of thetas.
+    N: int
+        Number of ensemble members.
+    noiseLevel: float
+        Relative standard deviation of the observations.
+    noiseFloor: float
+        Minimum standard deviation of each observation channel as a fraction of noiseLevel times the
+        channel RMS (set by run), so zero samples do not make the measurement covariance singular.
+    method: str
+        Analysis step: 'stochastic' (perturbed observations) or 'etkf' (ensemble transform).
+
+    """
+
+    def __init__(self, zeroDModel, rcr_ref, P, Q, N, noiseLevel=0.05, noiseFloor=1e-3, method='stochastic'):
+
+        self.zeroDModel = zeroDModel
+        self.rcr_ref = np.asarray(rcr_ref, dtype=float)
+        self.n_params = self.rcr_ref.size
+        self.Q = Q*np.eye(self.n_params)
+        self.N = N
+        self.noiseLevel = noiseLevel
+        self.noiseFloor = noiseFloor
+        self.minimumVariance = np.finfo(float).tiny
+        self.method = method
+
+        self.thetas = multivariate_normal(mean=np.zeros(self.n_params), cov=P*np.eye(self.n_params), size=N)
+        self.x = np.zeros((N, zeroDModel.n_state))
+
+    def parameters(self):
+        """RCR parameters of each ensemble member (N, n_outlets, 3).
+
+        """
+
+        return self.rcr_ref*2**self.thetas.reshape((self.N,)+self.rcr_ref.shape)
+
+    def step(self, t, dt, z):
+        """Forecast and analysis for one observation.
+
+        Parameters
+        ----------
+        t: float
+            Observation time.
+        dt: float
+            Time step.
+        z: array
+            Observed [P of each outlet, Q of each outlet].
+
+        Returns
+        -------
+        theta: array
+            Ensemble mean of thetas.
+        y_mean: array
+            Ensemble mean of forecasted observations.
+
+        """
+
+        N = self.N
+        n_params = self.n_params
+
+        self.thetas += multivariate_normal(mean=np.zeros(n_params), cov=self.Q, size=N)
+        rcr = self.parameters()
+        self.x = self.zeroDModel.step(self.x, rcr, t, dt)
+        Y = self.zeroDModel.observe(self.x, rcr)
+
+        R = np.diag(np.maximum((self.noiseLevel*z)**2, self.minimumVariance))
+        augmented = np.column_stack((self.thetas, self.x))
+
+        if self.method=='etkf':
+            augmented = transformUpdate(augmented, Y, z, R)
+        else:
+            E = multivariate_normal(mean=np.zeros(len(z)), cov=R, size=N)
+            augmented = stochasticUpdate(augmented, np.mean(augmented, axis=0), Y, z, E, R)
+
+        self.thetas = augmented[:,:n_params]
+        self.x = augmented[:,n_params:]
+
+        return np.mean(self.thetas, axis=0), np.mean(Y, axis=0)
+
+    def run(self, t, z):
+        """Runs the filter over the whole observation series.
+
+        Parameters
+        ----------
+        t: array
+            Time array.
+        z: array
+            Observations (n_steps, 2*n_outlets).
+
+        Returns
+        -------
+        estimates: array
+            RCR estimates for each time step (n_steps, n_outlets, 3).
+        zs: array
+            Ensemble mean of forecasted observations (n_steps, 2*n_outlets).
+
+        """
+
+        self.minimumVariance = np.maximum((self.noiseLevel*self.noiseFloor)**2*np.mean(np.square(z), axis=0),
+                np.finfo(float).tiny)
+
+        estimates = np.zeros((len(t),)+self.rcr_ref.shape)
+        zs = np.zeros_like(z)
+        estimates[0] = self.rcr_ref*2**np.mean(self.thetas, axis=0).reshape(self.rcr_ref.shape)
+
+        for i in range(1, len(t)):
+            theta, zs[i] = self.step(t[i], t[i]-t[i-1], z[i])
+            estimates[i] = self.rcr_ref*2**theta.reshape(self.rcr_ref.shape)
+
+        return estimates, zs
+
+if __name__=='__main__':
+    path = 'CarotidArtery_0D'
+    input = 'solver_0d.in'
+
+    model = readZeroDModel(os.path.join(path, input))
+    zeroDModel = ZeroDEnsembleModel(model)
+
+    #synthetic observations from the input file RCR values
+    rcr_true = model['rcr']
+    t, y = zeroDModel.simulate(rcr_true[None])
+    z = y[:,0]*(1+0.01*np.random.normal(size=y[:,0].shape))
+
+    #initial guess 50% away from the true values
+    rcr_guess = rcr_true*np.array([1.5, 0.5, 1.5])
+
+    enkf = MultiOutletEnKF(zeroDModel, rcr_guess, P=0.25, Q=1e-5, N=200, noiseLevel=0.05)
+    estimates, zs = enkf.run(t, z)
+
+    labels = ['$R_p$', 'C', '$R_d$']
+    fig, ax = plt.subplots(zeroDModel.n_outlets, 3)
+    for k, name in enumerate(model['names']):
+        for j in range(3):
+            ax[k,j].plot(t, estimates[:,k,j], color='gray')
+            ax[k,j].plot(t, rcr_true[k,j]*np.ones(len(t)), linestyle='--', color='k')
+            ax[k,j].set_ylabel(labels[j]+' '+name)
+            ax[k,j].set_xlabel('t (s)')
+    plt.show()
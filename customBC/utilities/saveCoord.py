@@ -4,10 +4,12 @@
 """Import stl from boundary surface and save boundary points coordinates.
 """
 import csv
+import io
 import numpy as np
 from stl import mesh
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import proj3d
+from surfacePreprocessing import weldVertices
 
 def visualize_boundaryPoints(points):
     """
@@ -23,19 +25,42 @@ def visualize_boundaryPoints(points):
     ax.scatter(points[:,0], points[:,1], points[:,2], color='k')
     plt.show()
 
+def writeBoundaryPoints(points, fileName, binary=False, precision=10):
+    """Writes points as an OpenFOAM vectorField list (the format read by flowRatePoiseuilleVelocity).
+    The whole array is formatted at once instead of one write per point.
+
+    Parameters
+    ----------
+    points: array
+        Points (n_points, 3).
+    fileName: str
+        Output file name.
+    binary: bool
+        Writes the list in OpenFOAM binary format (float64 values between parentheses). The stream
+        must then be read in binary mode (e.g. IFstream(name, IOstream::BINARY)).
+    precision: int
+        Significant digits of ascii output.
+
+    """
+
+    points = np.ascontiguousarray(points, dtype='<f8')
+
+    with open(fileName, 'wb') as f:
+        f.write((str(len(points))+'\n(').encode())
+        if binary:
+            f.write(points.tobytes())
+        else:
+            buffer = io.StringIO()
+            buffer.write('\n')
+            np.savetxt(buffer, points, fmt='(%.{0}g %.{0}g %.{0}g)'.format(precision))
+            f.write(buffer.getvalue().encode())
+        f.write(b')\n')
 
 if __name__=='__main__':
 
     surfaceMesh = mesh.Mesh.from_file('stlRecon/IXI160-LICA.stl')
-    shape = np.shape(surfaceMesh.vectors)
-    points = np.unique(surfaceMesh.vectors.reshape([shape[0]*3,3]), axis=0)
-
-    f = open('boundaryPoints_LICA','w', encoding='UTF8')
-    f.write(str(len(points))+'\n')
-    f.write('('+'\n')
-    for point in points:
-        f.write('('+str(point[0])+' '+str(point[1])+' '+str(point[2])+')'+'\n')
-    f.write(')'+'\n')
-    f.close()
+    points, _ = weldVertices(surfaceMesh.vectors, tol=1e-6)
+
+    writeBoundaryPoints(points, 'boundaryPoints_LICA')
 
     visualize_boundaryPoints(points)
@@ -0,0 +1,170 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Boundary surface preprocessing for boundary condition generators. Triangle vertices from stl (e.g. AM1/constant/trisurface or marching cubes surfaces from 3dRecon.py) are welded with a spatial hash, face centres, areas and normals are computed on the welded mesh and everything is cached as a compact .npz next to the stl.
+
+"""
+
+import os
+import numpy as np
+from stl import mesh
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+def readTriangles(fileName):
+    """Triangle vertices from stl file.
+
+    Parameters
+    ----------
+    fileName: str
+        Surface stl file.
+
+    Returns
+    -------
+    triangles: array
+        Triangle vertices (n_faces, 3, 3).
+
+    """
+
+    return mesh.Mesh.from_file(fileName).vectors.astype(float)
+
+def cellKeys(cells):
+    """Single int64 key for each integer grid cell (n, 3).
+
+    """
+
+    cells = cells-cells.min(axis=0)+1
+    dims = cells.max(axis=0)+2
+
+    if np.prod(dims.astype(float))>=2**63:
+        raise ValueError('Welding tolerance too small for the surface extent.')
+
+    return (cells[:,0]*dims[1]+cells[:,1])*dims[2]+cells[:,2], dims
+
+def weldVertices(triangles, tol=1e-6):
+    """Merges vertices closer than tol. Vertices are hashed to tol sized cells, cells are merged
+    with the neighbour cells (looked up on the sorted cell keys) whose mean point is closer than
+    tol, and faces that collapse after welding are removed.
+
+    Parameters
+    ----------
+    triangles: array
+        Triangle vertices (n_faces, 3, 3).
+    tol: float
+        Welding tolerance (same unit as the stl).
+
+    Returns
+    -------
+    vertices: array
+        Welded vertices (n_vertices, 3).
+    faces: array
+        Vertex indices of each face (n_faces, 3).
+
+    """
+
+    points = np.asarray(triangles, dtype=float).reshape(-1, 3)
+
+    keys, dims = cellKeys(np.floor(points/tol).astype(np.int64))
+    keys, vertexCell = np.unique(keys, return_inverse=True)
+    vertexCell = vertexCell.reshape(-1)
+    n_cells = len(keys)
+
+    counts = np.bincount(vertexCell, minlength=n_cells)
+    centres = np.stack([np.bincount(vertexCell, points[:,i], n_cells) for i in range(3)], axis=1)/counts[:,None]
+
+    offsets = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                        if (i, j, k)>(0, 0, 0)])
+    rows, cols = [np.arange(n_cells)], [np.arange(n_cells)]
+    for offset in (offsets[:,0]*dims[1]+offsets[:,1])*dims[2]+offsets[:,2]:
+        index = np.minimum(np.searchsorted(keys, keys+offset), n_cells-1)
+        close = (keys[index]==keys+offset)&(np.linalg.norm(centres[index]-centres, axis=1)<tol)
+        rows.append(np.flatnonzero(close))
+        cols.append(index[close])
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    graph = coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n_cells, n_cells))
+    n_vertices, cellLabel = connected_components(graph, directed=False)
+
+    label = cellLabel[vertexCell]
+    vertices = np.stack([np.bincount(label, points[:,i], n_vertices) for i in range(3)], axis=1)
+    vertices /= np.bincount(label, minlength=n_vertices)[:,None]
+
+    faces = label.reshape(-1, 3)
+    faces = faces[(faces[:,0]!=faces[:,1])&(faces[:,1]!=faces[:,2])&(faces[:,0]!=faces[:,2])]
+
+    return vertices, faces.astype(np.int32)
+
+def faceGeometry(vertices, faces):
+    """Face centres, areas and unit normals.
+
+    Parameters
+    ----------
+    vertices: array
+        Vertices (n_vertices, 3).
+    faces: array
+        Vertex indices of each face (n_faces, 3).
+
+    Returns
+    -------
+    centres: array
+        Face centres (n_faces, 3).
+    areas: array
+        Face areas (n_faces,).
+    normals: array
+        Face unit normals (n_faces, 3).
+
+    """
+
+    triangles = vertices[faces]
+
+    centres = triangles.mean(axis=1)
+
+    normals = np.cross(triangles[:,1]-triangles[:,0], triangles[:,2]-triangles[:,0])
+    areas = 0.5*np.linalg.norm(normals, axis=1)
+    normals = np.divide(normals, 2*areas[:,None], out=np.zeros_like(normals), where=areas[:,None]>0)
+
+    return centres, areas, normals
+
+def loadSurface(fileName, tol=1e-6, cacheName=None):
+    """Welded surface and face geometry from stl. The result is cached as .npz (by default next to the
+    stl) and read back while the cache is newer than the stl and was built with the same tolerance.
+
+    Parameters
+    ----------
+    fileName: str
+        Surface stl file.
+    tol: float
+        Welding tolerance.
+    cacheName: str
+        Cache file name (default: stl name with .npz extension).
+
+    Returns
+    -------
+    surface: dict
+        vertices, faces, centres, areas and normals arrays.
+
+    """
+
+    if cacheName is None:
+        cacheName = os.path.splitext(fileName)[0]+'.npz'
+
+    if os.path.exists(cacheName) and os.path.getmtime(cacheName)>=os.path.getmtime(fileName):
+        with np.load(cacheName) as cache:
+            if float(cache['tol'])==tol:
+                return {name: cache[name] for name in ('vertices', 'faces', 'centres', 'areas', 'normals')}
+
+    vertices, faces = weldVertices(readTriangles(fileName), tol)
+    centres, areas, normals = faceGeometry(vertices, faces)
+
+    surface = {'vertices': vertices, 'faces': faces, 'centres': centres, 'areas': areas, 'normals': normals}
+    np.savez_compressed(cacheName, tol=tol, **surface)
+
+    return surface
+
+if __name__=='__main__':
+
+    trisurfacePath = '../../AM1/constant/trisurface'
+
+    for boundary in ['AM1_inlet', 'AM1_outlet', 'AM1_wall']:
+        surface = loadSurface(os.path.join(trisurfacePath, boundary+'.stl'))
+        print(boundary, len(surface['vertices']), 'vertices,', len(surface['faces']), 'faces, area =', surface['areas'].sum())
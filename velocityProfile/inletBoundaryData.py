@@ -0,0 +1,230 @@
+#Author: Gustavo Solcia
+#E-mail: gustavo.solcia@usp.br
+
+"""Womersley inlet velocity written as OpenFOAM timeVaryingMappedFixedValue boundary data (constant/boundaryData/<patch>/points and constant/boundaryData/<patch>/<time>/U). The inlet surface is read from stl (as in customBC/utilities/saveCoord.py) and the flow rate from a waveform csv (as in velocityProfile.py). Radial distances of all face centres are evaluated at once, the waveform harmonics are computed once and each chunk of time directories evaluates and writes its own velocities on a process pool.
+
+Boundary condition example (0/U):
+
+    inlet
+    {
+        type            timeVaryingMappedFixedValue;
+        offset          (0 0 0);
+        setAverage      off;
+    }
+
+"""
+
+import os
+import sys
+import numpy as np
+from multiprocessing import Pool
+from velocityProfile import readFlowRateWaveform, harmonicCoefficients, womersleyShapeFunctions
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'customBC', 'utilities'))
+
+from surfacePreprocessing import loadSurface
+
+def readInletSurface(fileName, tol=1e-6):
+    """Face centres, areas and unit normals from an inlet stl surface (welded and cached as .npz by surfacePreprocessing.loadSurface).
+
+    Parameters
+    ----------
+    fileName: str
+        Inlet surface stl file.
+    tol: float
+        Vertex welding tolerance.
+
+    Returns
+    -------
+    centres: array
+        Face centres (n_faces, 3).
+    areas: array
+        Face areas (n_faces,).
+    normals: array
+        Face unit normals (n_faces, 3).
+
+    """
+
+    surface = loadSurface(fileName, tol)
+
+    return surface['centres'], surface['areas'], surface['normals']
+
+def inletGeometry(centres, areas, normals):
+    """Inlet centroid, mean unit normal, equivalent radius and radial distance of every face centre.
+
+    Parameters
+    ----------
+    centres: array
+        Face centres (n_faces, 3).
+    areas: array
+        Face areas (n_faces,).
+    normals: array
+        Face unit normals (n_faces, 3).
+
+    Returns
+    -------
+    centroid: array
+        Area weighted centroid of the inlet.
+    normal: array
+        Area weighted unit normal of the inlet.
+    radius: float
+        Radius of the circle with the same area as the inlet.
+    distance: array
+        Distance from each face centre to the inlet axis (n_faces,).
+
+    """
+
+    centroid = np.dot(areas, centres)/areas.sum()
+
+    normal = np.dot(areas, normals)
+    normal = normal/np.linalg.norm(normal)
+
+    radius = np.sqrt(areas.sum()/np.pi)
+
+    d = centres-centroid
+    distance = np.linalg.norm(d-np.outer(np.dot(d, normal), normal), axis=1)
+
+    return centroid, normal, radius, distance
+
+def formatVectorField(values, objectName='values', precision=8):
+    """OpenFOAM ascii vector list (with FoamFile header) from a (n, 3) array. The whole list is formatted with a single string operation.
+
+    """
+
+    header = ('FoamFile\n{\n    version     2.0;\n    format      ascii;\n'
+              '    class       vectorField;\n    object      '+objectName+';\n}\n\n')
+    row = '({{:.{0}g}} {{:.{0}g}} {{:.{0}g}})\n'.format(precision)
+
+    return header+str(len(values))+'\n(\n'+(row*len(values)).format(*np.ravel(values))+')\n'
+
+def writeBoundaryPoints(boundaryPath, points, precision=8):
+    """Writes the points file of a boundaryData patch.
+
+    """
+
+    os.makedirs(boundaryPath, exist_ok=True)
+
+    with open(os.path.join(boundaryPath, 'points'), 'w', encoding='UTF8') as f:
+        f.write(formatVectorField(points, 'points', precision))
+
+def writeTimeChunk(boundaryPath, timeNames, samples, n_time, coefficients, alpha, radius, distance, direction,
+        precision=8):
+    """Evaluates the Womersley velocity for a chunk of time steps and writes their <time>/U files. Only the velocities of the chunk are kept in memory.
+
+    Parameters
+    ----------
+    boundaryPath: str
+        constant/boundaryData/<patch> directory.
+    timeNames: list
+        Time directory names of the chunk.
+    samples: array
+        Waveform sample index of each time step.
+    n_time: int
+        Number of waveform samples in one period.
+    coefficients: array
+        Flow rate harmonic amplitudes (from harmonicCoefficients).
+    alpha: float
+        Womersley number of the fundamental frequency.
+    radius: float
+        Inlet radius.
+    distance: array
+        Distance from each face centre to the inlet axis (n_faces,).
+    direction: array
+        Unit vector of the inflow direction.
+    precision: int
+        Significant digits.
+
+    Returns
+    -------
+    n: int
+        Number of written files.
+
+    """
+
+    K = len(coefficients)-1
+    shapeFunctions = womersleyShapeFunctions(alpha, K, np.minimum(distance, radius)/radius)
+
+    phase = np.exp(2j*np.pi*np.outer(samples, np.arange(K+1))/n_time)
+    magnitude = np.matmul(phase*coefficients, shapeFunctions).real/(np.pi*radius**2)
+
+    for timeName, u in zip(timeNames, magnitude):
+        timePath = os.path.join(boundaryPath, timeName)
+        os.makedirs(timePath, exist_ok=True)
+        with open(os.path.join(timePath, 'U'), 'w', encoding='UTF8') as f:
+            f.write(formatVectorField(np.outer(u, direction), 'U', precision))
+
+    return len(timeNames)
+
+def writeInletBoundaryData(casePath, patchName, stlFile, waveformFile, period, nu, K=10, n_cycle=1,
+        flipNormal=False, precision=8, processes=None, chunkSize=100):
+    """Womersley velocity at every inlet face centre written as timeVaryingMappedFixedValue data.
+
+    Parameters
+    ----------
+    casePath: str
+        OpenFOAM case directory.
+    patchName: str
+        Inlet patch name.
+    stlFile: str
+        Inlet surface stl file.
+    waveformFile: str
+        csv with t and flow columns (one period, uniformly sampled).
+    period: float
+        period from pulsatile waveform.
+    nu: float
+        blood kinematic viscosity.
+    K: int
+        Number of harmonics.
+    n_cycle: int
+        Number of cycles written.
+    flipNormal: bool
+        Flow along (instead of against) the stl normal. Inflow is opposite to outward normals.
+    precision: int
+        Significant digits.
+    processes: int
+        Number of worker processes (default: number of CPUs).
+    chunkSize: int
+        Number of time steps per task.
+
+    Returns
+    -------
+    boundaryPath: str
+        Written boundaryData directory.
+
+    """
+
+    centres, areas, normals = readInletSurface(stlFile)
+    centroid, normal, radius, distance = inletGeometry(centres, areas, normals)
+    direction = normal if flipNormal else -normal
+
+    t, flowRate = readFlowRateWaveform(waveformFile)
+
+    coefficients = harmonicCoefficients(flowRate, K)
+    alpha = np.sqrt(2*np.pi/(nu*period))*radius
+
+    boundaryPath = os.path.join(casePath, 'constant', 'boundaryData', patchName)
+    writeBoundaryPoints(boundaryPath, centres, precision)
+
+    times = np.add.outer(period*np.arange(n_cycle), t).reshape(-1)
+    timeNames = ['{:.{}g}'.format(time, precision) for time in times]
+    n_time = len(t)
+
+    tasks = [(boundaryPath, timeNames[start:start+chunkSize], np.arange(start, min(start+chunkSize, len(times)))%n_time,
+              n_time, coefficients, alpha, radius, distance, direction, precision)
+             for start in range(0, len(times), chunkSize)]
+
+    with Pool(processes) as pool:
+        pool.starmap(writeTimeChunk, tasks)
+
+    return boundaryPath
+
+if __name__=='__main__':
+
+    casePath = '../AM1'
+    stlFile = '../AM1/constant/trisurface/AM1_inlet.stl'
+    waveformFile = 'Ford-YoungAdults-Waveform_ICA.csv'
+
+    period = 1
+    nu = 4.5e-4
+
+    writeInletBoundaryData(casePath, 'inlet', stlFile, waveformFile, period, nu)
@@ -9,6 +9,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.special import jv
+from functools import lru_cache
 
 def readFlowRateWaveform(fileName):
     """Reads flow rate waveform from given csv file.
@@ -30,17 +31,50 @@ def readFlowRateWaveform(fileName):
 
     return Waveform_df.get('t').to_numpy(), Waveform_df.get('flow').to_numpy()
 
-def calculatePoiseuille(flowRate, radius, r):
-    """Calculate the Poisseuile velocity profile from given waveform flow rate and radius.
+def broadcastProfileInputs(flowRate, radius, r):
+    """Reshapes flow rate, radius and radius grid for broadcasting on (n_vessels, n_time, n_r) profiles.
 
     Parameters
     ----------
     flowRate: array
-        flow rate array with interpolated waveform.
+        flow rate array (n_time,) or batch of waveforms (n_vessels, n_time).
     radius: float
-        radius from specific artery.
+        radius from specific artery or array of radii (n_vessels,).
     r: array
-        radius linear spaced array.
+        radius linear spaced array (n_r,) or one array per vessel (n_vessels, n_r).
+
+    Returns
+    -------
+    q: array
+        flow rate with shape (..., n_time, 1).
+    R: array
+        radius with shape (..., 1, 1).
+    rr: array
+        radius grid with shape (..., 1, n_r).
+
+    """
+
+    q = np.asarray(flowRate)[...,:,None]
+    R = np.asarray(radius, dtype=float)[...,None,None]
+    rr = np.asarray(r)[...,None,:]
+
+    return q, R, rr
+
+def calculatePoiseuille(flowRate, radius, r, out=None, dtype=np.float64):
+    """Calculate the Poisseuile velocity profile from given waveform flow rate and radius. Accepts a batch of vessels (waveforms, radii and radius grids) computed with broadcasting.
+
+    Parameters
+    ----------
+    flowRate: array
+        flow rate array with interpolated waveform, (n_time,) or (n_vessels, n_time).
+    radius: float
+        radius from specific artery, float or (n_vessels,).
+    r: array
+        radius linear spaced array, (n_r,) or (n_vessels, n_r).
+    out: array
+        Optional output buffer with shape (n_time, n_r) or (n_vessels, n_time, n_r).
+    dtype: dtype
+        Output type (e.g. np.float32) when out is not given.
 
     Returns
     -------
@@ -49,25 +83,35 @@ def calculatePoiseuille(flowRate, radius, r):
 
     """
 
-    PoiseuilleProfile = [2*q/(np.pi*radius**2)*(1-r**2/radius**2) for q in flowRate]
+    q, R, rr = broadcastProfileInputs(flowRate, radius, r)
+
+    shapeFunction = 2*(1-rr**2/R**2)/(np.pi*R**2)
+
+    if out is None:
+        out = np.empty(np.broadcast_shapes(q.shape, shapeFunction.shape), dtype=dtype)
+    PoiseuilleProfile = np.multiply(q, shapeFunction, out=out, casting='same_kind')
 
     return PoiseuilleProfile
 
-def calculateWomersley(flowRate, radius, r, period, nu):
-    """Calculate the Womersley velocity profile from given waveform and flow parameters.
+def calculateWomersley(flowRate, radius, r, period, nu, out=None, dtype=np.float64):
+    """Calculate the Womersley velocity profile from given waveform and flow parameters. Accepts a batch of vessels (waveforms, radii and radius grids) computed with broadcasting.
 
     Parameters
     ----------
     flowRate: array
-        flow rate array with interpolated waveform.
+        flow rate array with interpolated waveform, (n_time,) or (n_vessels, n_time).
     radius: float
-        radius from specific artery.
+        radius from specific artery, float or (n_vessels,).
     r: array
-        radius linear spaced array.
+        radius linear spaced array, (n_r,) or (n_vessels, n_r).
     period: float
         period from pulsatile waveform.
     nu: float
         blood dynamic viscosity.
+    out: array
+        Optional output buffer with shape (n_time, n_r) or (n_vessels, n_time, n_r).
+    dtype: dtype
+        Output type (e.g. np.float32) when out is not given.
 
     Returns
     -------
@@ -76,17 +120,145 @@ def calculateWomersley(flowRate, radius, r, period, nu):
 
     """
 
-    alpha = np.sqrt(2*np.pi/(nu*period))*radius
+    q, R, rr = broadcastProfileInputs(flowRate, radius, r)
+
+    alpha = np.sqrt(2*np.pi/(nu*period))*R
     gamma = alpha*(1j-1)/np.sqrt(2)
     
     shapeFunction = (gamma*jv(0,gamma)-
-        gamma*jv(0,gamma*r/radius))/(gamma*jv(0,gamma)-
+        gamma*jv(0,gamma*rr/R))/(gamma*jv(0,gamma)-
         2*jv(1,gamma))
 
-    WomersleyProfile = np.array([(q/(np.pi*radius**2))*shapeFunction.real for q in flowRate])
+    shapeFunction = shapeFunction.real/(np.pi*R**2)
+
+    if out is None:
+        out = np.empty(np.broadcast_shapes(q.shape, shapeFunction.shape), dtype=dtype)
+    WomersleyProfile = np.multiply(q, shapeFunction, out=out, casting='same_kind')
 
     return WomersleyProfile
 
+@lru_cache(maxsize=64)
+def _cachedShapeFunctions(alpha, K, rRatioBytes):
+    """Cached Womersley shape functions (see womersleyShapeFunctions). The radius grid is passed as bytes to be hashable.
+
+    """
+
+    rRatio = np.frombuffer(rRatioBytes)
+
+    shapeFunctions = np.zeros((K+1, len(rRatio)), dtype=complex)
+    shapeFunctions[0] = 2*(1-rRatio**2)
+
+    n = np.arange(1, K+1)[:,None]
+    gamma = alpha*np.sqrt(n)*(1j-1)/np.sqrt(2)
+
+    shapeFunctions[1:] = (gamma*jv(0,gamma)-
+        gamma*jv(0,gamma*rRatio))/(gamma*jv(0,gamma)-
+        2*jv(1,gamma))
+
+    shapeFunctions.setflags(write=False)
+
+    return shapeFunctions
+
+def womersleyShapeFunctions(alpha, K, rRatio):
+    """Complex Womersley shape functions for the mean flow (Poiseuille) and the first K harmonics. Results are kept in a LRU cache keyed by (alpha, K, radius grid), so Bessel functions are evaluated once per radius grid.
+
+    Parameters
+    ----------
+    alpha: float
+        Womersley number of the fundamental frequency.
+    K: int
+        Number of harmonics.
+    rRatio: array
+        Radius grid normalized by the artery radius (r/radius).
+
+    Returns
+    -------
+    shapeFunctions: array
+        Read only complex array with shape (K+1, len(rRatio)).
+
+    """
+
+    rRatio = np.ascontiguousarray(np.abs(rRatio), dtype=float)
+
+    return _cachedShapeFunctions(float(alpha), int(K), rRatio.tobytes())
+
+def harmonicCoefficients(flowRate, K=10):
+    """Mean flow and first K harmonic amplitudes of a flow rate waveform (one period sampled uniformly), such that flowRate = Re(sum_k c_k exp(2 pi i k n/n_time)).
+
+    Parameters
+    ----------
+    flowRate: array
+        flow rate array (one period), (n_time,) or (n_vessels, n_time).
+    K: int
+        Number of harmonics (limited by the Nyquist frequency).
+
+    Returns
+    -------
+    coefficients: array
+        Complex amplitudes with shape (..., K+1).
+
+    """
+
+    q = np.asarray(flowRate)
+    n_time = q.shape[-1]
+    K = min(K, (n_time-1)//2)
+
+    coefficients = np.fft.rfft(q, axis=-1)[...,:K+1]/n_time
+    coefficients[...,1:] *= 2
+
+    return coefficients
+
+def calculateWomersleyHarmonics(flowRate, radius, r, period, nu, K=10, out=None, dtype=np.float64):
+    """Calculate the multi-harmonic Womersley velocity profile. The flow rate waveform (one period sampled uniformly) is decomposed with FFT, the first K harmonics are kept, and the profile is obtained with a single matrix product between the harmonic time series and the cached shape functions. Accepts a batch of vessels.
+
+    Parameters
+    ----------
+    flowRate: array
+        flow rate array with interpolated waveform (one period), (n_time,) or (n_vessels, n_time).
+    radius: float
+        radius from specific artery, float or (n_vessels,).
+    r: array
+        radius linear spaced array, (n_r,) or (n_vessels, n_r).
+    period: float
+        period from pulsatile waveform.
+    nu: float
+        blood kinematic viscosity.
+    K: int
+        Number of harmonics.
+    out: array
+        Optional output buffer with shape (n_time, n_r) or (n_vessels, n_time, n_r).
+    dtype: dtype
+        Output type (e.g. np.float32) when out is not given.
+
+    Returns
+    -------
+    WomersleyProfile: array
+        Womersley velocity profile with shape (n_time, n_r) or (n_vessels, n_time, n_r).
+
+    """
+
+    q, R, rr = broadcastProfileInputs(flowRate, radius, r)
+    q = q[...,0]
+    n_time = q.shape[-1]
+
+    coefficients = harmonicCoefficients(q, K)[...,None,:]
+    K = coefficients.shape[-1]-1
+
+    alpha = np.sqrt(2*np.pi/(nu*period))*R
+    rRatio = np.abs(rr/R)[...,0,:]
+    shapeFunctions = np.array([womersleyShapeFunctions(alpha_i, K, rRatio_i) for alpha_i, rRatio_i in
+        zip(alpha.reshape(-1), np.broadcast_to(rRatio, alpha.shape[:-2]+rRatio.shape[-1:]).reshape(-1, rRatio.shape[-1]))])
+    shapeFunctions = shapeFunctions.reshape(alpha.shape[:-2]+shapeFunctions.shape[-2:])
+
+    phase = np.exp(2j*np.pi*np.outer(np.arange(n_time), np.arange(K+1))/n_time)
+
+    profile = np.matmul(phase*coefficients, shapeFunctions).real
+
+    if out is None:
+        out = np.empty(profile.shape, dtype=dtype)
+    WomersleyProfile = np.divide(profile, np.pi*R**2, out=out, casting='same_kind')
+
+    return WomersleyProfile
 
 
 if __name__=='__main__':
@@ -103,7 +275,7 @@ if __name__=='__main__':
 
     PoiseuilleProfile = calculatePoiseuille(flowRate, radius, r)
 
-    WomersleyProfile = calculateWomersley(flowRate, radius, r, period, nu) 
+    WomersleyProfile = calculateWomersleyHarmonics(flowRate, radius, r, period, nu)
 
 
     plt.figure(figsize=(20,10))